@@ -0,0 +1,364 @@
+"""
+Container and codec detection for uploaded recordings.
+
+:func:`probe` reads the headers of a recording and reports its container,
+codec, sample rate and channel count, plus the Speech-to-Text encoding that
+can decode it as is. Recordings that Speech-to-Text can't read (or whose
+parameters it doesn't accept) get ``encoding=None`` and are converted with
+:mod:`app.transcode` first.
+
+Supported layouts:
+
+- WAV: the ``fmt`` chunk (PCM, mu-law, and WAVE_FORMAT_EXTENSIBLE)
+- FLAC: the STREAMINFO block, optionally after an ID3 tag
+- Ogg: the first packet (Opus, Vorbis, FLAC or Speex)
+- MP3: the first MPEG audio frame header after any ID3v2 tag
+- WebM/Matroska: the EBML header and the first audio TrackEntry
+- MP4/M4A (``ftyp``) and AMR/AMR-WB magic bytes
+"""
+import struct
+from typing import Optional, Tuple
+
+# Sample rates Speech-to-Text accepts for Opus audio
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+# Sample rates Speech-to-Text accepts for uncompressed and FLAC audio
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 48000
+
+
+class AudioInfo:
+    def __init__(
+        self,
+        container: str,
+        codec: str,
+        encoding: Optional[str] = None,
+        sample_rate: Optional[int] = None,
+        channels: Optional[int] = None,
+        bits_per_sample: Optional[int] = None,
+    ):
+        self.container = container
+        self.codec = codec
+        # Name of the RecognitionConfig.AudioEncoding, or None if the audio must be converted
+        self.encoding = encoding
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.bits_per_sample = bits_per_sample
+
+    def __repr__(self):
+        return (
+            f"AudioInfo(container={self.container!r}, codec={self.codec!r}, encoding={self.encoding!r}, "
+            f"sample_rate={self.sample_rate}, channels={self.channels}, bits_per_sample={self.bits_per_sample})"
+        )
+
+
+UNKNOWN = AudioInfo("unknown", "unknown")
+
+
+def _accepts_rate(sample_rate: Optional[int]) -> bool:
+    return sample_rate is not None and MIN_SAMPLE_RATE <= sample_rate <= MAX_SAMPLE_RATE
+
+
+def probe(data: bytes) -> AudioInfo:
+    """
+    Identify a recording from its headers.
+
+    Args:
+        data: The start of the recording (the whole file is fine; a few KB
+            is enough for everything but WebM files with large headers)
+
+    Returns:
+        AudioInfo; ``container`` is "unknown" if the format wasn't recognized
+    """
+    view = memoryview(data)
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        return _probe_wav(view)
+    if data[:4] == b"OggS":
+        return _probe_ogg(view)
+    if data[:4] == b"\x1a\x45\xdf\xa3":
+        return _probe_ebml(view)
+    if data[4:8] == b"ftyp":
+        return AudioInfo("mp4", data[8:12].decode("latin-1").strip() or "mp4")
+    if data.startswith(b"#!AMR-WB\n"):
+        return AudioInfo("amr", "amr-wb", "AMR_WB", 16000, 1)
+    if data.startswith(b"#!AMR\n"):
+        return AudioInfo("amr", "amr", "AMR", 8000, 1)
+
+    offset = _skip_id3(view)
+    if data[offset:offset + 4] == b"fLaC":
+        return _probe_flac(view, offset)
+    return _probe_mpeg(view, offset)
+
+
+def _skip_id3(view: memoryview) -> int:
+    """Return the offset just past any ID3v2 tags."""
+    offset = 0
+    while bytes(view[offset:offset + 3]) == b"ID3" and len(view) >= offset + 10:
+        flags = view[offset + 5]
+        size_bytes = view[offset + 6:offset + 10]
+        # Tag sizes are "syncsafe": 7 bits per byte
+        size = 0
+        for byte in size_bytes:
+            size = (size << 7) | (byte & 0x7F)
+        offset += 10 + size + (10 if flags & 0x10 else 0)
+    return offset
+
+
+# WAV
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_MULAW = 0x0007
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def _probe_wav(view: memoryview) -> AudioInfo:
+    offset = 12
+    while offset + 8 <= len(view):
+        chunk_id = bytes(view[offset:offset + 4])
+        (chunk_size,) = struct.unpack_from("<I", view, offset + 4)
+        if chunk_id == b"fmt " and offset + 24 <= len(view):
+            format_tag, channels, sample_rate = struct.unpack_from("<HHI", view, offset + 8)
+            (bits_per_sample,) = struct.unpack_from("<H", view, offset + 22)
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40 and offset + 34 <= len(view):
+                # The real format is the first two bytes of the SubFormat GUID
+                (format_tag,) = struct.unpack_from("<H", view, offset + 32)
+
+            encoding = None
+            if format_tag == WAVE_FORMAT_PCM and bits_per_sample == 16:
+                encoding = "LINEAR16"
+                codec = "pcm_s16le"
+            elif format_tag == WAVE_FORMAT_MULAW and bits_per_sample == 8:
+                encoding = "MULAW"
+                codec = "mulaw"
+            elif format_tag == WAVE_FORMAT_IEEE_FLOAT:
+                codec = f"pcm_f{bits_per_sample}le"
+            elif format_tag == WAVE_FORMAT_PCM:
+                # 8-bit WAV samples are unsigned
+                codec = "pcm_u8" if bits_per_sample == 8 else f"pcm_s{bits_per_sample}le"
+            else:
+                codec = f"wav_{format_tag:#06x}"
+            if not _accepts_rate(sample_rate):
+                encoding = None
+            return AudioInfo("wav", codec, encoding, sample_rate, channels, bits_per_sample)
+        # Chunks are padded to an even size
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return AudioInfo("wav", "unknown")
+
+
+# FLAC
+
+def _probe_flac(view: memoryview, offset: int) -> AudioInfo:
+    block = offset + 4
+    # STREAMINFO is always the first metadata block: 4-byte header + 34 bytes
+    if block + 4 + 18 > len(view) or view[block] & 0x7F != 0:
+        return AudioInfo("flac", "flac")
+    info = block + 4 + 10  # skip block sizes (2+2) and frame sizes (3+3)
+    (packed,) = struct.unpack_from(">Q", view, info)
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    bits_per_sample = ((packed >> 36) & 0x1F) + 1
+    encoding = "FLAC" if _accepts_rate(sample_rate) and bits_per_sample in (16, 24) else None
+    return AudioInfo("flac", "flac", encoding, sample_rate, channels, bits_per_sample)
+
+
+# Ogg
+
+def _probe_ogg(view: memoryview) -> AudioInfo:
+    if len(view) < 27:
+        return AudioInfo("ogg", "unknown")
+    segments = view[26]
+    packet = 27 + segments
+    head = bytes(view[packet:packet + 19])
+
+    if head.startswith(b"OpusHead") and len(head) >= 16:
+        channels = head[9]
+        (input_rate,) = struct.unpack_from("<I", head, 12)
+        # Opus decodes at 48 kHz; the header only records the original rate
+        sample_rate = input_rate if input_rate in OPUS_SAMPLE_RATES else 48000
+        return AudioInfo("ogg", "opus", "OGG_OPUS", sample_rate, channels)
+    if head.startswith(b"\x01vorbis") and len(head) >= 16:
+        channels = head[11]
+        (sample_rate,) = struct.unpack_from("<I", head, 12)
+        return AudioInfo("ogg", "vorbis", None, sample_rate, channels)
+    if head.startswith(b"\x7fFLAC"):
+        info = _probe_flac(view, packet + 9)
+        return AudioInfo("ogg", "flac", None, info.sample_rate, info.channels, info.bits_per_sample)
+    if head.startswith(b"Speex   "):
+        return AudioInfo("ogg", "speex")
+    return AudioInfo("ogg", "unknown")
+
+
+# MP3
+
+# Layer III bitrates in kbps by bitrate index, for MPEG-1 and for MPEG-2/2.5
+MPEG1_L3_BITRATES = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+MPEG2_L3_BITRATES = (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+MPEG_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),  # MPEG-1
+    2: (22050, 24000, 16000),  # MPEG-2
+    0: (11025, 12000, 8000),   # MPEG-2.5
+}
+# How far past the ID3 tag to look for the first frame
+MPEG_SYNC_SEARCH_BYTES = 64 * 1024
+
+
+def _mpeg_frame(view: memoryview, offset: int) -> Optional[Tuple[int, int, int, int]]:
+    """Parse a frame header; returns (layer, sample_rate, channels, frame_length) or None."""
+    if offset + 4 > len(view):
+        return None
+    (header,) = struct.unpack_from(">I", view, offset)
+    if header >> 21 != 0x7FF:
+        return None
+    version = (header >> 19) & 0x3
+    layer = 4 - ((header >> 17) & 0x3)
+    bitrate_index = (header >> 12) & 0xF
+    rate_index = (header >> 10) & 0x3
+    padding = (header >> 9) & 0x1
+    channel_mode = (header >> 6) & 0x3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    sample_rate = MPEG_SAMPLE_RATES[version][rate_index]
+    channels = 1 if channel_mode == 3 else 2
+    if layer != 3:
+        return layer, sample_rate, channels, 0
+    if version == 3:
+        frame_length = 144000 * MPEG1_L3_BITRATES[bitrate_index] // sample_rate + padding
+    else:
+        frame_length = 72000 * MPEG2_L3_BITRATES[bitrate_index] // sample_rate + padding
+    return layer, sample_rate, channels, frame_length
+
+
+def _probe_mpeg(view: memoryview, offset: int) -> AudioInfo:
+    end = min(len(view) - 3, offset + MPEG_SYNC_SEARCH_BYTES)
+    for position in range(offset, max(end, offset)):
+        if view[position] != 0xFF:
+            continue
+        frame = _mpeg_frame(view, position)
+        if frame is None:
+            continue
+        layer, sample_rate, channels, frame_length = frame
+        # A real frame is followed by another one (unless the data ends first)
+        following = position + frame_length
+        if frame_length and following + 4 <= len(view) and _mpeg_frame(view, following) is None:
+            continue
+        if layer != 3:
+            return AudioInfo("mpeg", f"mp{layer}", None, sample_rate, channels)
+        return AudioInfo("mp3", "mp3", "MP3", sample_rate, channels)
+    return UNKNOWN
+
+
+# EBML (WebM / Matroska)
+
+EBML_HEADER = 0x1A45DFA3
+EBML_DOCTYPE = 0x4282
+SEGMENT = 0x18538067
+CLUSTER = 0x1F43B675
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+AUDIO = 0xE1
+SAMPLING_FREQUENCY = 0xB5
+CHANNELS = 0x9F
+BIT_DEPTH = 0x6264
+
+# Master elements that are searched for the audio track
+EBML_MASTERS = {SEGMENT, TRACKS, TRACK_ENTRY, AUDIO}
+TRACK_TYPE_AUDIO = 2
+# Unknown-size elements (MediaRecorder streams) have all size bits set
+EBML_UNKNOWN_SIZE = object()
+
+
+def _read_vint(view: memoryview, offset: int, keep_marker: bool) -> Tuple[Optional[int], int]:
+    """Read an EBML variable-length integer; returns (value, new offset)."""
+    if offset >= len(view):
+        raise IndexError
+    first = view[offset]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        length += 1
+        mask >>= 1
+    if length > 8 or offset + length > len(view):
+        raise IndexError
+    value = first if keep_marker else first & (mask - 1)
+    for byte in view[offset + 1:offset + length]:
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        return EBML_UNKNOWN_SIZE, offset + length
+    return value, offset + length
+
+
+def _ebml_uint(data: bytes) -> int:
+    return int.from_bytes(data, "big") if data else 0
+
+
+def _ebml_float(data: bytes) -> Optional[float]:
+    if len(data) == 4:
+        return struct.unpack(">f", data)[0]
+    if len(data) == 8:
+        return struct.unpack(">d", data)[0]
+    return None
+
+
+def _probe_ebml(view: memoryview) -> AudioInfo:
+    doc_type = "matroska"
+    track = None
+    tracks = []
+    offset = 0
+    try:
+        while offset < len(view):
+            element_id, offset = _read_vint(view, offset, keep_marker=True)
+            size, offset = _read_vint(view, offset, keep_marker=False)
+
+            if element_id == CLUSTER:
+                # Track headers always come before the first cluster
+                break
+            if element_id == TRACK_ENTRY:
+                track = {}
+                tracks.append(track)
+            if element_id in EBML_MASTERS or element_id == EBML_HEADER:
+                # Descend into the element
+                continue
+            if size is EBML_UNKNOWN_SIZE:
+                break
+
+            data = bytes(view[offset:offset + size])
+            if element_id == EBML_DOCTYPE:
+                doc_type = data.decode("ascii", errors="replace").rstrip("\x00")
+            elif track is not None:
+                if element_id == TRACK_TYPE:
+                    track["type"] = _ebml_uint(data)
+                elif element_id == CODEC_ID:
+                    track["codec"] = data.decode("ascii", errors="replace").rstrip("\x00")
+                elif element_id == SAMPLING_FREQUENCY:
+                    track["sample_rate"] = _ebml_float(data)
+                elif element_id == CHANNELS:
+                    track["channels"] = _ebml_uint(data)
+                elif element_id == BIT_DEPTH:
+                    track["bits_per_sample"] = _ebml_uint(data)
+            offset += size
+    except IndexError:
+        # Truncated header: use what was parsed
+        pass
+
+    container = "webm" if doc_type == "webm" else "matroska"
+    audio = next(
+        (t for t in tracks if t.get("type") == TRACK_TYPE_AUDIO or str(t.get("codec", "")).startswith("A_")),
+        None,
+    )
+    if audio is None:
+        return AudioInfo(container, "unknown")
+
+    codec_id = audio.get("codec", "")
+    codec = codec_id[2:].lower() if codec_id.startswith("A_") else codec_id.lower()
+    sample_rate = int(audio["sample_rate"]) if audio.get("sample_rate") else None
+    channels = audio.get("channels", 1)
+    encoding = None
+    if codec_id == "A_OPUS":
+        encoding = "WEBM_OPUS"
+        # Opus decodes at 48 kHz whatever the track says
+        if sample_rate not in OPUS_SAMPLE_RATES:
+            sample_rate = 48000
+    return AudioInfo(container, codec, encoding, sample_rate, channels, audio.get("bits_per_sample"))
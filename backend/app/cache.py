@@ -0,0 +1,363 @@
+"""
+Small caching primitives shared by the routers.
+
+- :class:`LRUCache` is an in-memory LRU map with an optional TTL.
+- :class:`DiskCache` stores blobs in a directory and evicts the least
+  recently used files once the directory grows past a byte budget.
+- :class:`TieredCache` puts an :class:`LRUCache` in front of a
+  :class:`DiskCache` for JSON-serializable values.
+
+All caches keep hit/miss counters that are exposed through ``stats()``.
+
+:class:`SingleFlight` coalesces concurrent calls (or streams) for the same
+key so only one upstream request is in flight at a time.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+# Root directory for on-disk caches
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(tempfile.gettempdir(), "vibelearning-cache"))
+
+
+def make_key(*parts: Any) -> str:
+    """Build a stable cache key from arbitrary parts (bytes or str-able values)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, (bytes, bytearray, memoryview)):
+            part = str(part).encode("utf-8")
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache. Entries expire after ``ttl`` seconds if set."""
+
+    def __init__(self, max_items: int = 256, ttl: Optional[float] = None):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return default
+            expires_at, value = self._items[key]
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._items[key]
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._items[key] = (expires_at, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "items": len(self._items),
+            "max_items": self.max_items,
+        }
+
+
+class _SharedStream:
+    """The items of one async iterator, replayed to any number of readers."""
+
+    def __init__(self):
+        self.items: List[Any] = []
+        self.finished = False
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def run(self, items: AsyncIterator[Any]) -> List[Any]:
+        try:
+            async for item in items:
+                self.items.append(item)
+                self._notify()
+        finally:
+            self.finished = True
+            self._notify()
+        return self.items
+
+    async def follow(self, task: asyncio.Task) -> AsyncIterator[Any]:
+        index = 0
+        while True:
+            while index < len(self.items):
+                yield self.items[index]
+                index += 1
+            if self.finished:
+                break
+            await self._changed.wait()
+        # Re-raise the upstream error, if any
+        await asyncio.shield(task)
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent async calls that share a key.
+
+    The first caller for a key starts the coroutine as a task; callers
+    arriving while it is in flight await the same result (or exception)
+    instead of issuing their own upstream request. A caller being cancelled
+    does not cancel the shared call.
+
+    :meth:`stream` does the same for async iterators, and shares the key
+    space with :meth:`do`.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._streams: Dict[str, _SharedStream] = {}
+        self.coalesced = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def stream(self, key: str, func: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """
+        Stream the items of ``func()``, shared with concurrent callers for ``key``.
+
+        The first caller starts consuming the iterator in a task, so it runs
+        to completion even if every reader goes away. Each reader gets every
+        item from the start, as it is produced. do() callers for the same key
+        get the list of all items; a stream joining a do() call yields the
+        items of its result once it is done.
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            shared = self._streams.get(key)
+        else:
+            shared = _SharedStream()
+            task = asyncio.ensure_future(shared.run(func()))
+            self._inflight[key] = task
+            self._streams[key] = shared
+
+            def done(_):
+                self._inflight.pop(key, None)
+                self._streams.pop(key, None)
+            task.add_done_callback(done)
+
+        if shared is None:
+            for item in await asyncio.shield(task):
+                yield item
+            return
+        async for item in shared.follow(task):
+            yield item
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "inflight": len(self._inflight),
+            "coalesced": self.coalesced,
+        }
+
+
+class DiskCache:
+    """
+    Directory-backed blob cache with size-based LRU eviction.
+
+    Recency is tracked with file mtimes so the cache survives restarts and
+    can be shared by several worker processes.
+
+    The directory is scanned once to size the cache; after that a running
+    byte total is kept per process and the directory is only scanned again
+    when the total goes over ``max_bytes``. Eviction then frees space down
+    to ``EVICT_TARGET`` of the budget (counting other workers' writes too),
+    so a full cache is not rescanned on every write.
+
+    Every method touches the disk: call them through ``asyncio.to_thread``
+    from async code.
+    """
+
+    # Fraction of max_bytes the cache is shrunk to when it overflows
+    EVICT_TARGET = 0.9
+
+    def __init__(self, directory: str, max_bytes: int, suffix: str = ".bin"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._total: Optional[int] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def get_path(self, key: str) -> Optional[str]:
+        """Return the path of a cached entry (marking it as recently used) or None."""
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            # Evicted by another worker between the lookup and the read
+            return None
+
+    def set_bytes(self, key: str, data: bytes) -> str:
+        """Store a blob atomically and return its path."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        return self.commit(key, tmp_path)
+
+    def commit(self, key: str, tmp_path: str) -> str:
+        """Move a fully written file into the cache under ``key`` and return its path."""
+        path = self.path_for(key)
+        size = os.path.getsize(tmp_path)
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._total is None:
+                self._total = self._scan()[1]
+            else:
+                self._total += size - replaced
+            over_budget = self._total > self.max_bytes
+        if over_budget:
+            self.evict(keep=path)
+        return path
+
+    def _scan(self):
+        """Return the cache's entries as (mtime, size, path) and their total size."""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(self.suffix):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        return entries, total
+
+    def evict(self, keep: Optional[str] = None):
+        """Delete least recently used entries (other than ``keep``) until the cache is back under budget."""
+        with self._lock:
+            entries, total = self._scan()
+            target = self.max_bytes * self.EVICT_TARGET if total > self.max_bytes else self.max_bytes
+            entries.sort()
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+            self._total = total
+
+    def stats(self) -> Dict[str, int]:
+        entries, size = self._scan()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "items": len(entries),
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class TieredCache:
+    """
+    In-memory LRU tier in front of an on-disk tier for JSON values.
+
+    Async code should use :meth:`aget` and :meth:`aset`, which only leave the
+    event loop for the disk tier.
+    """
+
+    def __init__(self, directory: str, max_items: int = 256, max_bytes: int = 64 * 1024 * 1024):
+        self.memory = LRUCache(max_items)
+        self.disk = DiskCache(directory, max_bytes, suffix=".json")
+
+    def _decode(self, key: str, data: Optional[bytes]) -> Any:
+        if data is None:
+            return None
+        try:
+            value = json.loads(data)
+        except json.JSONDecodeError:
+            return None
+        self.memory.set(key, value)
+        return value
+
+    def get(self, key: str) -> Any:
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        return self._decode(key, self.disk.get_bytes(key))
+
+    def set(self, key: str, value: Any):
+        self.memory.set(key, value)
+        self.disk.set_bytes(key, json.dumps(value).encode("utf-8"))
+
+    async def aget(self, key: str) -> Any:
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        return self._decode(key, await asyncio.to_thread(self.disk.get_bytes, key))
+
+    async def aset(self, key: str, value: Any):
+        self.memory.set(key, value)
+        await asyncio.to_thread(self.disk.set_bytes, key, json.dumps(value).encode("utf-8"))
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            "memory": self.memory.stats(),
+            "disk": self.disk.stats(),
+        }
@@ -0,0 +1,176 @@
+"""
+Token-budgeted rolling context for the learner chat.
+
+Sending the complete history on every turn makes each turn slower and more
+expensive than the last. :func:`rolling_context` instead keeps the most
+recent messages verbatim within ``CHAT_CONTEXT_TOKEN_BUDGET`` (estimated
+tokens) and folds everything older into a running summary.
+
+Summaries are cached under a hash of the message prefix they cover, so a
+conversation that keeps growing reuses the summary from its previous turns
+and only the newly dropped messages are folded in. Folding happens in the
+background: a turn uses the best summary already available (and a few more
+verbatim messages than the budget asks for) instead of waiting on a summary
+call. Only when the verbatim part grows past twice the budget is the fold
+done inline.
+"""
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+from app import llm_gateway
+from app.cache import LRUCache, SingleFlight, make_key
+
+logger = logging.getLogger(__name__)
+
+# Estimated tokens of verbatim history sent with each turn
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "2000"))
+# Most messages sent verbatim, whatever their size
+CHAT_CONTEXT_MAX_MESSAGES = int(os.getenv("CHAT_CONTEXT_MAX_MESSAGES", "12"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "400"))
+CHARS_PER_TOKEN = 4
+
+SUMMARY_CONFIG = {
+    "temperature": 0.2,
+    "max_output_tokens": CHAT_SUMMARY_MAX_TOKENS,
+}
+
+# Summaries keyed on the hash of the message prefix they cover
+summary_cache = LRUCache(
+    max_items=int(os.getenv("CHAT_SUMMARY_CACHE_MAX_ITEMS", "1024")),
+    ttl=float(os.getenv("CHAT_SUMMARY_CACHE_TTL", str(6 * 60 * 60))),
+)
+summary_flight = SingleFlight()
+_background_folds = set()
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    return estimate_tokens(message.get("content", ""))
+
+
+def prefix_keys(messages: List[Dict[str, str]]) -> List[str]:
+    """
+    Return a key for every prefix of ``messages``.
+
+    ``keys[i]`` identifies ``messages[:i]``, so the key of a prefix never
+    changes as the conversation grows.
+    """
+    keys = [make_key("chat")]
+    for message in messages:
+        keys.append(make_key(keys[-1], message.get("role", ""), message.get("content", "")))
+    return keys
+
+
+def recent_start(messages: List[Dict[str, str]], budget: int = CHAT_CONTEXT_TOKEN_BUDGET) -> int:
+    """Index of the first message of the longest suffix that fits the budget (at least one message)."""
+    start = len(messages)
+    used = 0
+    while start > 0 and len(messages) - start < CHAT_CONTEXT_MAX_MESSAGES:
+        cost = message_tokens(messages[start - 1])
+        if used + cost > budget and start < len(messages):
+            break
+        used += cost
+        start -= 1
+    return start
+
+
+def _cached_summary(keys: List[str], end: int) -> Tuple[int, Optional[str]]:
+    """Find the longest prefix up to ``end`` messages with a cached summary."""
+    for covered in range(end, 0, -1):
+        summary = summary_cache.get(keys[covered])
+        if summary is not None:
+            return covered, summary
+    return 0, None
+
+
+def _summary_prompt(summary: Optional[str], messages: List[Dict[str, str]]) -> str:
+    transcript = "\n".join(
+        f"{'Learner' if message.get('role') == 'assistant' else 'Teacher'}: {message.get('content', '')}"
+        for message in messages
+    )
+    previous = summary or "(none yet)"
+    return f"""
+    You keep a running summary of a lesson in which a teacher explains a topic to a learner.
+    Update the summary with the new messages below.
+
+    Keep: the topic, what the teacher has explained so far, the learner's questions,
+    misunderstandings and what they have understood, and any open threads.
+    Write plain prose, at most {CHAT_SUMMARY_MAX_TOKENS // 2} words. Respond with ONLY the updated summary.
+
+    Current summary:
+    {previous}
+
+    New messages:
+    {transcript}
+    """
+
+
+async def _fold(messages, keys, end):
+    """Summarize ``messages[:end]``, starting from the longest cached shorter prefix."""
+    covered, summary = _cached_summary(keys, end)
+    if covered == end:
+        return summary
+    response = await llm_gateway.generate_content(
+        _summary_prompt(summary, messages[covered:end]),
+        SUMMARY_CONFIG,
+    )
+    summary = response.text.strip()
+    summary_cache.set(keys[end], summary)
+    return summary
+
+
+def _fold_in_background(messages, keys, end):
+    async def fold():
+        try:
+            await summary_flight.do(keys[end], lambda: _fold(messages, keys, end))
+        except Exception as e:
+            logger.error(f"Error summarizing chat history: {str(e)}")
+
+    task = asyncio.ensure_future(fold())
+    _background_folds.add(task)
+    task.add_done_callback(_background_folds.discard)
+
+
+async def rolling_context(
+    chat_history: List[Dict[str, str]],
+    budget: int = CHAT_CONTEXT_TOKEN_BUDGET,
+) -> Tuple[Optional[str], List[Dict[str, str]]]:
+    """
+    Reduce a chat history to a summary of older messages plus recent ones verbatim.
+
+    Args:
+        chat_history: Messages with "role" and "content", oldest first
+        budget: Estimated tokens of verbatim history to aim for
+
+    Returns:
+        tuple: The summary of the messages before the verbatim ones (None if
+        nothing is summarized) and the verbatim messages
+    """
+    messages = [message for message in chat_history if message.get("role") != "system"]
+    start = recent_start(messages, budget)
+    if start == 0:
+        return None, messages
+
+    # The newest summary is usable as long as the messages after it fit the budget
+    keys = prefix_keys(messages)
+    covered, summary = _cached_summary(keys, len(messages) - 1)
+    if covered < start:
+        # Fold down to half the budget so the next few turns need no new summary
+        end = recent_start(messages, budget // 2)
+        overflow = sum(message_tokens(message) for message in messages[covered:])
+        if overflow > 2 * budget:
+            # Too far behind to send verbatim: fold now
+            try:
+                summary = await summary_flight.do(keys[end], lambda: _fold(messages, keys, end))
+                covered = end
+            except Exception as e:
+                logger.error(f"Error summarizing chat history: {str(e)}")
+        else:
+            _fold_in_background(messages, keys, end)
+
+    return summary, messages[covered:]
@@ -0,0 +1,149 @@
+"""
+Long-lived upstream API clients.
+
+Building a Speech or OpenAI client sets up a gRPC channel or HTTP
+connection pool, and the first request on it pays for the TLS handshake and
+auth. The app's lifespan (see app.main) builds one :class:`Clients` at
+startup, stores it on ``app.state.clients`` and closes it on shutdown;
+routers get it with the :func:`get_clients` dependency and pass it to the
+helpers that call the APIs. Gemini ``GenerativeModel`` objects are memoized
+per model and generation config on the same instance.
+
+With ``WARM_CLIENTS`` set, startup also opens every connection with a cheap
+metadata call, so the first user request does not pay the connection cost.
+
+Helpers fall back to :func:`current`, which returns the instance the
+lifespan installed, when they are not given one (code that runs outside a
+request, such as background evaluation and the chat prompts, and scripts).
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import google.generativeai as genai
+from dotenv import load_dotenv
+from google.cloud import speech
+from openai import AsyncOpenAI, OpenAI
+from starlette.requests import HTTPConnection
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WARM_CLIENTS = os.getenv("WARM_CLIENTS", "false").lower() in ("1", "true", "yes")
+
+CLIENT_FACTORIES = {
+    "speech": speech.SpeechClient,
+    "speech_async": speech.SpeechAsyncClient,
+    "openai": OpenAI,
+    "async_openai": AsyncOpenAI,
+}
+
+
+class Clients:
+    """
+    The upstream clients shared by every request.
+
+    Every client is created up front. One that can't be created (missing
+    credentials, say) is logged and created again on first use, so the
+    features that don't need it keep working. Create instances from the
+    app's event loop: the asyncio Speech client binds to it.
+    """
+
+    def __init__(self):
+        self._clients: Dict[str, Any] = {}
+        self._models: Dict[Tuple[str, str], genai.GenerativeModel] = {}
+        for name in CLIENT_FACTORIES:
+            try:
+                self._get(name)
+            except Exception as e:
+                logger.warning(f"Could not create {name} client, will retry on first use: {str(e)}")
+
+    def _get(self, name: str) -> Any:
+        client = self._clients.get(name)
+        if client is None:
+            client = CLIENT_FACTORIES[name]()
+            self._clients[name] = client
+        return client
+
+    @property
+    def speech_client(self) -> speech.SpeechClient:
+        return self._get("speech")
+
+    @property
+    def speech_async_client(self) -> speech.SpeechAsyncClient:
+        return self._get("speech_async")
+
+    @property
+    def openai_client(self) -> OpenAI:
+        return self._get("openai")
+
+    @property
+    def async_openai_client(self) -> AsyncOpenAI:
+        return self._get("async_openai")
+
+    def gemini_model(self, model_name: str, generation_config: Optional[Dict[str, Any]] = None) -> genai.GenerativeModel:
+        """Return a shared GenerativeModel for a model name and generation config."""
+        # Schemas in the config are types, so key on their repr
+        key = (model_name, json.dumps(generation_config, sort_keys=True, default=repr))
+        model = self._models.get(key)
+        if model is None:
+            model = genai.GenerativeModel(model_name, generation_config=generation_config)
+            self._models[key] = model
+        return model
+
+    async def warmup(self, gemini_model_name: str, openai_model_name: str):
+        """
+        Open every client's connection with a cheap metadata call.
+
+        Failures are logged and ignored; the client will connect on first use.
+        """
+        async def warm(name, func):
+            try:
+                await func()
+                logger.info(f"Warmed up {name} client")
+            except Exception as e:
+                logger.warning(f"Could not warm up {name} client: {str(e)}")
+
+        await asyncio.gather(
+            warm("gemini", lambda: asyncio.to_thread(genai.get_model, f"models/{gemini_model_name}")),
+            warm("openai", lambda: self.async_openai_client.models.retrieve(openai_model_name)),
+            warm("openai (sync)", lambda: asyncio.to_thread(lambda: self.openai_client.models.retrieve(openai_model_name))),
+        )
+
+    async def aclose(self):
+        """Close every client that was created."""
+        clients, self._clients = self._clients, {}
+        self._models.clear()
+        if "async_openai" in clients:
+            await clients["async_openai"].close()
+        if "openai" in clients:
+            clients["openai"].close()
+        if "speech_async" in clients:
+            await clients["speech_async"].transport.close()
+        if "speech" in clients:
+            clients["speech"].transport.close()
+
+
+_current: Optional[Clients] = None
+
+
+def install(instance: Optional[Clients]):
+    """Make ``instance`` the process's clients (None uninstalls them)."""
+    global _current
+    _current = instance
+
+
+def current() -> Clients:
+    """The installed clients, created on first use when no lifespan installed any."""
+    global _current
+    if _current is None:
+        _current = Clients()
+    return _current
+
+
+def get_clients(connection: HTTPConnection) -> Clients:
+    """FastAPI dependency returning the clients created by the app's lifespan."""
+    return connection.app.state.clients
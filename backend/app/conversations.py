@@ -0,0 +1,106 @@
+"""
+Server-side conversation state for voice turns.
+
+A conversation is stored under an ID with its messages, so each voice turn
+only uploads the new audio: the server appends the transcription and the
+learner's reply itself. Conversations expire ``CONVERSATION_TTL`` seconds
+after their last turn.
+
+Turns on the same conversation are serialized with a per-conversation lock
+so concurrent uploads cannot drop each other's messages (within a worker).
+"""
+import asyncio
+import json
+import os
+import secrets
+import time
+import weakref
+from typing import Any, Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.stores import create_store
+
+CONVERSATION_BACKEND = os.getenv("CONVERSATION_BACKEND", "memory")
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", str(6 * 60 * 60)))
+CONVERSATION_MAX_ITEMS = int(os.getenv("CONVERSATION_MAX_ITEMS", "10000"))
+
+conversation_store = create_store(
+    CONVERSATION_BACKEND,
+    table="conversations",
+    ttl=CONVERSATION_TTL,
+    max_items=CONVERSATION_MAX_ITEMS,
+)
+
+_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+MESSAGE_ROLES = ("user", "assistant", "system")
+
+
+def parse_messages(messages: Any) -> List[Dict[str, str]]:
+    """
+    Normalize a chat history into a list of {"role", "content"} messages.
+
+    Accepts a JSON string or a list whose items are message dicts or JSON
+    strings of message dicts (the format older clients send).
+
+    Raises:
+        ValueError: If the history is not a list of messages
+    """
+    if isinstance(messages, (str, bytes)):
+        messages = json.loads(messages)
+    if not isinstance(messages, list):
+        raise ValueError("Chat history must be a JSON array of message objects")
+
+    parsed = []
+    for message in messages:
+        if isinstance(message, str):
+            message = json.loads(message)
+        if not isinstance(message, dict) or message.get("role") not in MESSAGE_ROLES:
+            raise ValueError("Chat history messages must have a role and content")
+        parsed.append({"role": message["role"], "content": str(message.get("content", ""))})
+    return parsed
+
+
+async def _call_store(method, *args):
+    if conversation_store.blocking:
+        return await run_in_threadpool(method, *args)
+    return method(*args)
+
+
+def lock(conversation_id: str) -> asyncio.Lock:
+    """Return the lock serializing turns on a conversation."""
+    conversation_lock = _locks.get(conversation_id)
+    if conversation_lock is None:
+        conversation_lock = asyncio.Lock()
+        _locks[conversation_id] = conversation_lock
+    return conversation_lock
+
+
+async def create_conversation(
+    messages: Optional[List[Dict[str, str]]] = None,
+    language_code: str = "en-US",
+) -> Dict[str, Any]:
+    now = time.time()
+    conversation = {
+        "id": secrets.token_urlsafe(12),
+        "language_code": language_code,
+        "messages": messages or [],
+        "created_at": now,
+        "updated_at": now,
+    }
+    await _call_store(conversation_store.set, conversation["id"], conversation)
+    return conversation
+
+
+async def get_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
+    return await _call_store(conversation_store.get, conversation_id)
+
+
+async def save_conversation(conversation: Dict[str, Any]):
+    conversation["updated_at"] = time.time()
+    await _call_store(conversation_store.set, conversation["id"], conversation)
+
+
+async def delete_conversation(conversation_id: str):
+    await _call_store(conversation_store.delete, conversation_id)
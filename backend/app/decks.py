@@ -0,0 +1,123 @@
+"""
+Server-side deck storage.
+
+Generated decks are stored under an ID so clients can refer to a deck
+instead of posting every card back on each request. Each card carries a
+stable ``id``, which lets edits be expressed as patch operations:
+
+- ``{"op": "update", "id": ..., "card": {...}}`` replaces a card's content
+- ``{"op": "delete", "id": ...}`` removes a card
+- ``{"op": "add", "card": {...}}`` appends a card; its new ID is filled in by
+  :func:`apply_patch`
+
+Every applied patch bumps the deck's ``version``. Edits to the same deck
+are serialized with a per-deck lock (within a worker), and clients can send
+the version they last saw to have an edit rejected if the deck has changed.
+"""
+import asyncio
+import os
+import secrets
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.stores import create_store
+
+DECK_BACKEND = os.getenv("DECK_BACKEND", "memory")
+DECK_TTL = float(os.getenv("DECK_TTL", str(7 * 24 * 60 * 60)))
+DECK_MAX_ITEMS = int(os.getenv("DECK_MAX_ITEMS", "10000"))
+
+deck_store = create_store(DECK_BACKEND, table="decks", ttl=DECK_TTL, max_items=DECK_MAX_ITEMS)
+
+_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def new_card_id() -> str:
+    return secrets.token_hex(4)
+
+
+def with_ids(cards: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Return copies of ``cards`` with an ``id`` on every card, keeping existing IDs."""
+    return [{**card, "id": card.get("id") or new_card_id()} for card in cards]
+
+
+async def _call_store(method, *args):
+    if deck_store.blocking:
+        return await run_in_threadpool(method, *args)
+    return method(*args)
+
+
+def lock(deck_id: str) -> asyncio.Lock:
+    """Return the lock serializing edits to a deck."""
+    deck_lock = _locks.get(deck_id)
+    if deck_lock is None:
+        deck_lock = asyncio.Lock()
+        _locks[deck_id] = deck_lock
+    return deck_lock
+
+
+async def create_deck(cards: List[Dict[str, str]], source: str) -> Dict[str, Any]:
+    """
+    Store a new deck and return it.
+
+    Args:
+        cards: The deck's cards; cards without an ``id`` get one
+        source: How the deck was generated ("auto" or "manual")
+    """
+    deck = {
+        "id": secrets.token_urlsafe(12),
+        "source": source,
+        "version": 1,
+        "cards": with_ids(cards),
+    }
+    await _call_store(deck_store.set, deck["id"], deck)
+    return deck
+
+
+async def get_deck(deck_id: str) -> Optional[Dict[str, Any]]:
+    return await _call_store(deck_store.get, deck_id)
+
+
+async def save_deck(deck: Dict[str, Any]):
+    await _call_store(deck_store.set, deck["id"], deck)
+
+
+def apply_patch(
+    cards: List[Dict[str, str]],
+    operations: List[Dict[str, Any]],
+) -> Tuple[List[Dict[str, str]], List[Dict[str, Any]]]:
+    """
+    Apply patch operations to a list of cards.
+
+    Operations on unknown card IDs are dropped. Added cards get a new ID.
+
+    Returns:
+        tuple: The new list of cards and the operations that were applied,
+        with the IDs of added cards filled in
+    """
+    by_id = {card["id"]: card for card in cards}
+    updated = {}
+    deleted = set()
+    added = []
+    applied = []
+
+    for operation in operations:
+        op = operation.get("op")
+        card_id = operation.get("id")
+        if op == "add":
+            card = {**operation["card"], "id": new_card_id()}
+            added.append(card)
+            applied.append({"op": "add", "card": card})
+        elif card_id in by_id and card_id not in deleted:
+            if op == "update":
+                card = {**operation["card"], "id": card_id}
+                updated[card_id] = card
+                applied.append({"op": "update", "id": card_id, "card": card})
+            elif op == "delete":
+                deleted.add(card_id)
+                updated.pop(card_id, None)
+                applied.append({"op": "delete", "id": card_id})
+
+    new_cards = [updated.get(card["id"], card) for card in cards if card["id"] not in deleted]
+    return new_cards + added, applied
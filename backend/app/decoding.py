@@ -0,0 +1,101 @@
+"""
+Shared decoding layer for structured Gemini output.
+
+Requests ask Gemini for JSON that matches a schema (``response_mime_type``
+plus ``response_schema``) via :func:`json_config`, which removes most
+malformed responses up front. Responses are then decoded with a single
+tolerant parser. It strips Markdown fences, and if strict decoding fails
+it recovers every complete object from a truncated or otherwise broken
+array instead of discarding the whole response.
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+from app.json_stream import parse_json_array_prefix
+
+
+def json_config(generation_config: Dict[str, Any], schema: Any) -> Dict[str, Any]:
+    """Return a copy of ``generation_config`` that constrains output to ``schema``."""
+    return {
+        **generation_config,
+        "response_mime_type": "application/json",
+        "response_schema": schema,
+    }
+
+
+def strip_fences(text: str) -> str:
+    """Remove Markdown code fences around a JSON payload."""
+    return text.replace("```json", "").replace("```", "").strip()
+
+
+def format_card(item: Any) -> Optional[Dict[str, str]]:
+    """Return a clean {"question", "answer"} card, or None if the item is not a valid card."""
+    if not isinstance(item, dict):
+        return None
+    question = str(item.get("question", "")).strip()
+    answer = str(item.get("answer", "")).strip()
+    if not question or not answer:
+        return None
+    return {"question": question, "answer": answer}
+
+
+def parse_array(text: str) -> List[Any]:
+    """
+    Decode a JSON array, salvaging the complete elements of a broken one.
+
+    A bare object is returned as a one-element array.
+
+    Raises:
+        ValueError: If the text contains no JSON array or objects at all
+    """
+    text = strip_fences(text)
+    try:
+        items = json.loads(text)
+    except json.JSONDecodeError:
+        # Salvage the complete objects of a truncated or malformed array
+        items = parse_json_array_prefix(text)
+        if not items:
+            raise ValueError("Response contains no JSON objects")
+
+    if isinstance(items, dict):
+        items = [items]
+    if not isinstance(items, list):
+        raise ValueError("Response is not a JSON array")
+    return items
+
+
+def parse_cards(text: str) -> List[Dict[str, str]]:
+    """
+    Decode a JSON array of flashcards, keeping every valid card.
+
+    Raises:
+        ValueError: If the text contains no JSON array or objects at all
+    """
+    cards = []
+    for item in parse_array(text):
+        card = format_card(item)
+        if card is not None:
+            cards.append(card)
+    return cards
+
+
+def parse_object(text: str) -> Dict[str, Any]:
+    """
+    Decode a single JSON object, tolerating fences and surrounding text.
+
+    Raises:
+        ValueError: If no JSON object can be recovered
+    """
+    text = strip_fences(text)
+    try:
+        value = json.loads(text)
+    except json.JSONDecodeError:
+        objects = [item for item in parse_json_array_prefix(text) if isinstance(item, dict)]
+        if not objects:
+            raise ValueError("Response contains no JSON object")
+        value = objects[0]
+    if isinstance(value, list) and value and isinstance(value[0], dict):
+        value = value[0]
+    if not isinstance(value, dict):
+        raise ValueError("Response is not a JSON object")
+    return value
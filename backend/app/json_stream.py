@@ -0,0 +1,97 @@
+"""
+Incremental parser for streamed JSON arrays.
+
+Models stream a JSON array of objects a few tokens at a time. The parser
+tracks nesting and string state across chunks and returns each top-level
+element as soon as it closes, so callers can act on the first object long
+before the array is complete. Anything before the opening ``[`` (such as a
+```json fence) is ignored, and a bare sequence of objects without the
+surrounding brackets is accepted too.
+"""
+import json
+from typing import Any, List
+
+
+class JSONArrayStreamParser:
+    """
+    Feed text chunks with :meth:`feed`; completed array elements are returned.
+
+    Elements that fail to decode are skipped.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._element_start = None
+        self._started = False
+        self.done = False
+
+    def feed(self, text: str) -> List[Any]:
+        """Consume a chunk of text and return the elements it completed."""
+        if self.done:
+            return []
+        self._buffer += text
+        elements = []
+
+        buffer = self._buffer
+        pos = self._pos
+        while pos < len(buffer):
+            char = buffer[pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                if self._started:
+                    self._in_string = True
+            elif char in "[{":
+                if not self._started:
+                    self._started = True
+                    if char == "[":
+                        pos += 1
+                        continue
+                    # Objects without a surrounding array: treat as if inside one
+                if self._depth == 0:
+                    self._element_start = pos
+                self._depth += 1
+            elif char in "]}":
+                if self._depth == 0:
+                    if char == "]" and self._started:
+                        self.done = True
+                        break
+                else:
+                    self._depth -= 1
+                    if self._depth == 0 and self._element_start is not None:
+                        element = self._decode(buffer[self._element_start:pos + 1])
+                        if element is not None:
+                            elements.append(element)
+                        self._element_start = None
+            pos += 1
+
+        # Drop consumed text, keeping only an element that is still open
+        if self._element_start is not None:
+            self._buffer = buffer[self._element_start:]
+            self._pos = pos - self._element_start
+            self._element_start = 0
+        else:
+            self._buffer = ""
+            self._pos = 0
+        return elements
+
+    @staticmethod
+    def _decode(text: str) -> Any:
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return None
+
+
+def parse_json_array_prefix(text: str) -> List[Any]:
+    """Return every complete element of a (possibly truncated) JSON array."""
+    return JSONArrayStreamParser().feed(text)
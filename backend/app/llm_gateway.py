@@ -0,0 +1,183 @@
+"""
+Shared async gateway for upstream model calls.
+
+Every Gemini request made by the app goes through :func:`generate_content`,
+which uses the SDK's native ``generate_content_async`` so a slow completion
+never blocks the event loop. SDKs without an async API (or blocking helpers
+around them) go through :func:`run_blocking`, which hands the call to a
+bounded per-provider thread pool.
+
+Each provider has its own concurrency limit so throughput scales with the
+number of in-flight requests instead of the number of worker processes.
+Limits are read from ``<PROVIDER>_CONCURRENCY`` environment variables, e.g.
+``GEMINI_CONCURRENCY=16``.
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import google.generativeai as genai
+from dotenv import load_dotenv
+
+from app import clients
+
+load_dotenv()
+genai.configure(api_key=os.getenv("API_KEY"))
+
+GEMINI_MODEL = "gemini-2.0-flash"
+
+# Default number of concurrent in-flight calls per upstream provider
+DEFAULT_CONCURRENCY = {
+    "gemini": 8,
+    "openai": 8,
+    "speech": 4,
+    # Streaming recognition sessions last as long as the learner talks
+    "speech_stream": 32,
+}
+
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+_executors: Dict[str, ThreadPoolExecutor] = {}
+
+
+def concurrency_limit(provider: str) -> int:
+    """Return the configured concurrency limit for a provider."""
+    default = DEFAULT_CONCURRENCY.get(provider, 4)
+    try:
+        return max(1, int(os.getenv(f"{provider.upper()}_CONCURRENCY", default)))
+    except ValueError:
+        return default
+
+
+def _semaphore(provider: str) -> asyncio.Semaphore:
+    if provider not in _semaphores:
+        _semaphores[provider] = asyncio.Semaphore(concurrency_limit(provider))
+    return _semaphores[provider]
+
+
+def _executor(provider: str) -> ThreadPoolExecutor:
+    if provider not in _executors:
+        _executors[provider] = ThreadPoolExecutor(
+            max_workers=concurrency_limit(provider),
+            thread_name_prefix=f"{provider}-gateway",
+        )
+    return _executors[provider]
+
+
+@asynccontextmanager
+async def limit(provider: str):
+    """
+    Hold one of the provider's concurrency slots for the duration of the block.
+
+    Useful for long-lived native async calls (e.g. streamed responses) that
+    should count against the provider limit.
+    """
+    async with _semaphore(provider):
+        yield
+
+
+async def run_blocking(provider: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Run a blocking SDK call on the provider's bounded thread pool.
+
+    Args:
+        provider: Name of the upstream provider (e.g. "speech", "openai")
+        func: The blocking callable
+        *args, **kwargs: Arguments forwarded to ``func``
+
+    Returns:
+        Whatever ``func`` returns
+    """
+    loop = asyncio.get_running_loop()
+    async with _semaphore(provider):
+        return await loop.run_in_executor(
+            _executor(provider), functools.partial(func, *args, **kwargs)
+        )
+
+
+def _model(
+    model_name: str,
+    generation_config: Optional[Dict[str, Any]],
+    cached_content: Any = None,
+    api_clients: Optional[clients.Clients] = None,
+):
+    if cached_content is not None:
+        return genai.GenerativeModel.from_cached_content(cached_content, generation_config=generation_config)
+    return (api_clients or clients.current()).gemini_model(model_name, generation_config)
+
+
+async def generate_content(
+    contents: Any,
+    generation_config: Optional[Dict[str, Any]] = None,
+    model_name: str = GEMINI_MODEL,
+    cached_content: Any = None,
+    api_clients: Optional[clients.Clients] = None,
+    **kwargs,
+):
+    """
+    Generate a Gemini completion without blocking the event loop.
+
+    Args:
+        contents: A prompt string or a list of Gemini message dicts
+        generation_config: Generation config passed to the model
+        model_name: Gemini model to use
+        cached_content: Optional cached context (see app.prompts) that the
+            contents continue from; its model is used instead of ``model_name``
+        api_clients: Shared upstream clients (defaults to clients.current())
+        **kwargs: Extra arguments forwarded to ``generate_content_async``
+
+    Returns:
+        The Gemini response object
+    """
+    model = _model(model_name, generation_config, cached_content, api_clients)
+    async with _semaphore("gemini"):
+        return await model.generate_content_async(contents, **kwargs)
+
+
+
+async def stream_content(
+    contents: Any,
+    generation_config: Optional[Dict[str, Any]] = None,
+    model_name: str = GEMINI_MODEL,
+    cached_content: Any = None,
+    api_clients: Optional[clients.Clients] = None,
+    **kwargs,
+) -> AsyncIterator[str]:
+    """
+    Stream a Gemini completion, yielding text as it is generated.
+
+    The provider slot is held until the stream is exhausted or closed.
+
+    Args:
+        contents: A prompt string or a list of Gemini message dicts
+        generation_config: Generation config passed to the model
+        model_name: Gemini model to use
+        cached_content: Optional cached context (see app.prompts) that the
+            contents continue from; its model is used instead of ``model_name``
+        api_clients: Shared upstream clients (defaults to clients.current())
+        **kwargs: Extra arguments forwarded to ``generate_content_async``
+
+    Yields:
+        Text fragments of the response
+    """
+    model = _model(model_name, generation_config, cached_content, api_clients)
+    async with _semaphore("gemini"):
+        response = await model.generate_content_async(contents, stream=True, **kwargs)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. the final finish_reason chunk)
+                continue
+            if text:
+                yield text
+
+
+def shutdown():
+    """Shut down the per-provider thread pools."""
+    for executor in _executors.values():
+        executor.shutdown(wait=False, cancel_futures=True)
+    _executors.clear()
+    _semaphores.clear()
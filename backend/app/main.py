@@ -1,16 +1,56 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers.tts import router as tts_router
 from app.routers.gemini import router as gemini_router
-from starlette.middleware.sessions import SessionMiddleware
-import secrets
+from app.uploads import UploadLimitMiddleware, MAX_AUDIO_UPLOAD_BYTES, MAX_PDF_UPLOAD_BYTES
+from app.sessions import ServerSessionMiddleware, create_session_store, session_secret
+from app import clients, conversations, decks, llm_gateway, pdf_text, prompts
+from app.routers.utils import incremental_evaluation
+from app.routers.utils.tts_utils import TTS_MODEL
 
+session_store = create_session_store()
 
-app = FastAPI()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Read the system prompts once instead of on every request
+    prompts.registry.load_all()
+    # Upstream clients shared by every request (routers get them with clients.get_clients)
+    app.state.clients = clients.Clients()
+    clients.install(app.state.clients)
+    # Open upstream connections before the first request needs them
+    if clients.WARM_CLIENTS:
+        await app.state.clients.warmup(llm_gateway.GEMINI_MODEL, TTS_MODEL)
+
+    yield
+
+    clients.install(None)
+    await app.state.clients.aclose()
+    llm_gateway.shutdown()
+    pdf_text.shutdown()
+    for store in (
+        session_store,
+        decks.deck_store,
+        conversations.conversation_store,
+        incremental_evaluation.checkpoint_store,
+    ):
+        store.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Reject oversized uploads before their multipart body is parsed
+app.add_middleware(
+    UploadLimitMiddleware,
+    limits={"/api/gemini": MAX_PDF_UPLOAD_BYTES, "/api/tts": MAX_AUDIO_UPLOAD_BYTES},
+)
+
+# Sessions live server-side; the cookie only carries a signed session ID
 app.add_middleware(
-    SessionMiddleware,
-    secret_key=secrets.token_urlsafe(32)  # Generate a random secret key
+    ServerSessionMiddleware,
+    store=session_store,
+    secret_key=session_secret(),  # Set SESSION_SECRET to share sessions across workers and restarts
 )
 
 # Include routers
@@ -28,6 +68,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Accept-Ranges", "Content-Length", "Content-Range", "X-Audio-Id", "X-Deck-Id"],
 )
 
 
@@ -0,0 +1,138 @@
+"""
+PDF text extraction.
+
+Large PDFs are split into page ranges that are extracted in parallel on a
+process pool (page extraction is CPU bound, so threads would serialize on
+the GIL), then joined in a single pass. Small PDFs are extracted in one
+worker thread. Either way extraction runs off the event loop.
+
+A PDF can be given as a path or as an open binary file (such as an
+upload's spool). Pool workers need a path, so a file object is written to a
+temporary file only when it is big enough to be extracted in parallel.
+
+Both ``pypdf`` and ``PyPDF2`` are supported; pick one with ``PDF_BACKEND``.
+"""
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, List, Optional, Tuple, Union
+
+PDF_BACKENDS = ("pypdf", "PyPDF2")
+PDF_BACKEND = os.getenv("PDF_BACKEND", "pypdf")
+
+# Process pool size, pages handled per task, and the page count below which
+# a PDF is extracted serially because process start-up would dominate
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _reader_class(backend: Optional[str] = None):
+    backend = (backend or PDF_BACKEND).lower()
+    if backend == "pypdf":
+        from pypdf import PdfReader
+    elif backend == "pypdf2":
+        from PyPDF2 import PdfReader
+    else:
+        raise ValueError(f"Unknown PDF backend {backend!r}, expected one of {PDF_BACKENDS}")
+    return PdfReader
+
+
+@contextlib.contextmanager
+def _open(source: Union[str, BinaryIO]):
+    """Yield a binary file for a path or an already open file (left open)."""
+    if isinstance(source, str):
+        with open(source, "rb") as file:
+            yield file
+    else:
+        source.seek(0)
+        yield source
+
+
+def count_pages(source: Union[str, BinaryIO], backend: Optional[str] = None) -> int:
+    """Return the number of pages in a PDF."""
+    with _open(source) as file:
+        return len(_reader_class(backend)(file).pages)
+
+
+def extract_page_range(path: str, start: int, end: int, backend: Optional[str] = None) -> str:
+    """Extract the text of pages ``[start, end)``. Runs inside pool workers."""
+    with open(path, "rb") as file:
+        pages = _reader_class(backend)(file).pages
+        return "".join(pages[i].extract_text() or "" for i in range(start, end))
+
+
+def extract_text(source: Union[str, BinaryIO], backend: Optional[str] = None) -> str:
+    """Extract the text of every page of a PDF in the calling thread."""
+    with _open(source) as file:
+        pages = _reader_class(backend)(file).pages
+        return "".join(page.extract_text() or "" for page in pages)
+
+
+def page_ranges(page_count: int, pages_per_task: int = PDF_PAGES_PER_TASK) -> List[Tuple[int, int]]:
+    """Split ``page_count`` pages into ``[start, end)`` ranges of at most ``pages_per_task``."""
+    return [
+        (start, min(start + pages_per_task, page_count))
+        for start in range(0, page_count, pages_per_task)
+    ]
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Spawn rather than fork: the server process already runs threads
+        _pool = ProcessPoolExecutor(
+            max_workers=PDF_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def _write_temp_file(file: BinaryIO) -> str:
+    file.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
+        shutil.copyfileobj(file, temp_file)
+    return temp_file.name
+
+
+async def extract_text_async(source: Union[str, BinaryIO], backend: Optional[str] = None) -> str:
+    """
+    Extract the text of a PDF without blocking the event loop.
+
+    Args:
+        source: Path of the PDF file, or an open binary file holding it
+        backend: "pypdf" or "PyPDF2" (defaults to PDF_BACKEND)
+
+    Returns:
+        The text of all pages, in page order
+    """
+    page_count = await asyncio.to_thread(count_pages, source, backend)
+    if page_count < PDF_PARALLEL_MIN_PAGES or PDF_WORKERS <= 1:
+        return await asyncio.to_thread(extract_text, source, backend)
+
+    path = source if isinstance(source, str) else await asyncio.to_thread(_write_temp_file, source)
+    try:
+        loop = asyncio.get_running_loop()
+        pool = _get_pool()
+        parts = await asyncio.gather(*[
+            loop.run_in_executor(pool, extract_page_range, path, start, end, backend)
+            for start, end in page_ranges(page_count)
+        ])
+    finally:
+        if path is not source:
+            os.unlink(path)
+    return "".join(parts)
+
+
+def shutdown():
+    """Shut down the extraction process pool."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
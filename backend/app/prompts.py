@@ -0,0 +1,209 @@
+"""
+Registry of the system prompts sent to Gemini.
+
+Prompts are read from disk once (at startup, or on first use) instead of on
+every request. The registry checks each file's mtime at most every
+``PROMPT_RELOAD_INTERVAL`` seconds and reloads prompts that changed, so
+prompt edits still take effect without a restart.
+
+With ``PROMPT_CONTEXT_CACHE`` enabled, a prompt is also uploaded once as
+Gemini cached content and later requests reference it by handle instead of
+resending it. Gemini only caches prompts above a minimum size, so creation
+can fail; the prompt is then sent inline as before, and creation is not
+retried until the prompt changes. A request that fails with a cached prompt
+is retried with the prompt inline, and the cached prompt is dropped the
+same way.
+"""
+import contextlib
+import datetime
+import hashlib
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from google.generativeai import caching
+
+from app import llm_gateway
+from app.cache import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+PROMPT_DIR = os.getenv("PROMPT_DIR", os.path.join(os.path.dirname(__file__), "routers", "utils"))
+PROMPT_FILES = {
+    "learner": "prompt.txt",
+    "evaluation": "evaluation_prompt.txt",
+}
+PROMPT_RELOAD_INTERVAL = float(os.getenv("PROMPT_RELOAD_INTERVAL", "2"))
+
+PROMPT_CONTEXT_CACHE = os.getenv("PROMPT_CONTEXT_CACHE", "false").lower() in ("1", "true", "yes")
+PROMPT_CONTEXT_CACHE_TTL = int(os.getenv("PROMPT_CONTEXT_CACHE_TTL", "3600"))
+# Cached content is replaced this long before it expires
+PROMPT_CONTEXT_CACHE_REFRESH = 60
+
+
+class Prompt:
+    def __init__(self, name: str, path: str, text: str, mtime: float):
+        self.name = name
+        self.path = path
+        self.text = text
+        self.mtime = mtime
+        self.version = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+
+    def message(self, extra_parts: Tuple[str, ...] = ()) -> Dict[str, Any]:
+        """The prompt as a user message (Gemini doesn't have a system role)."""
+        return {
+            "role": "user",
+            "parts": [{"text": self.text}] + [{"text": part} for part in extra_parts],
+        }
+
+
+class PromptRegistry:
+    def __init__(self, files: Dict[str, str], directory: str = PROMPT_DIR):
+        self.paths = {name: os.path.join(directory, filename) for name, filename in files.items()}
+        self._prompts: Dict[str, Prompt] = {}
+        self._checked_at: Dict[str, float] = {}
+        # name -> (prompt version, cached content or None if creation failed, expires_at)
+        self._context_caches: Dict[str, Tuple[str, Any, float]] = {}
+        self._flight = SingleFlight()
+
+    def load_all(self):
+        """Load every registered prompt; raises if a prompt file can't be read."""
+        for name in self.paths:
+            self._load(name)
+
+    def _load(self, name: str) -> Prompt:
+        path = self.paths[name]
+        mtime = os.stat(path).st_mtime
+        with open(path, "r") as file:
+            prompt = Prompt(name, path, file.read(), mtime)
+        self._prompts[name] = prompt
+        self._checked_at[name] = time.monotonic()
+        return prompt
+
+    def get(self, name: str) -> Prompt:
+        """Return a prompt, reloading it if its file changed."""
+        prompt = self._prompts.get(name)
+        if prompt is None:
+            return self._load(name)
+
+        now = time.monotonic()
+        if now - self._checked_at[name] >= PROMPT_RELOAD_INTERVAL:
+            self._checked_at[name] = now
+            try:
+                if os.stat(prompt.path).st_mtime != prompt.mtime:
+                    logger.info(f"Reloading prompt {name} from {prompt.path}")
+                    return self._load(name)
+            except OSError as e:
+                logger.error(f"Error checking prompt file {prompt.path}: {str(e)}")
+        return prompt
+
+    async def context_cache(self, name: str) -> Optional[Any]:
+        """
+        Return Gemini cached content holding the prompt, or None if it isn't available.
+        """
+        if not PROMPT_CONTEXT_CACHE:
+            return None
+        prompt = self.get(name)
+        entry = self._context_caches.get(name)
+        if entry is not None:
+            version, cached_content, expires_at = entry
+            if version == prompt.version and (
+                cached_content is None or expires_at - PROMPT_CONTEXT_CACHE_REFRESH > time.time()
+            ):
+                return cached_content
+        return await self._flight.do(f"{name}:{prompt.version}", lambda: self._create_context_cache(prompt))
+
+    async def _create_context_cache(self, prompt: Prompt) -> Optional[Any]:
+        expires_at = time.time() + PROMPT_CONTEXT_CACHE_TTL
+        try:
+            cached_content = await llm_gateway.run_blocking(
+                "gemini",
+                caching.CachedContent.create,
+                model=f"models/{llm_gateway.GEMINI_MODEL}",
+                display_name=f"vibelearning-{prompt.name}-{prompt.version}",
+                contents=[prompt.message()],
+                ttl=datetime.timedelta(seconds=PROMPT_CONTEXT_CACHE_TTL),
+            )
+        except Exception as e:
+            logger.warning(f"Context caching unavailable for prompt {prompt.name}, sending it inline: {str(e)}")
+            cached_content = None
+        self._context_caches[prompt.name] = (prompt.version, cached_content, expires_at)
+        return cached_content
+
+    def invalidate_context_cache(self, name: str):
+        """Stop using a prompt's cached content until the prompt changes."""
+        entry = self._context_caches.get(name)
+        if entry is not None:
+            self._context_caches[name] = (entry[0], None, entry[2])
+
+
+registry = PromptRegistry(PROMPT_FILES)
+
+
+async def _contents(name: str, messages: List[Dict[str, Any]], extra_parts: Tuple[str, ...]):
+    """Build the request contents, referencing the cached prompt when there is one."""
+    cached_content = await registry.context_cache(name)
+    if cached_content is None:
+        return [registry.get(name).message(extra_parts)] + messages, None
+    prefix = [{"role": "user", "parts": [{"text": part} for part in extra_parts]}] if extra_parts else []
+    return prefix + messages, cached_content
+
+
+async def generate_with_prompt(
+    name: str,
+    messages: List[Dict[str, Any]],
+    generation_config: Optional[Dict[str, Any]] = None,
+    extra_parts: Tuple[str, ...] = (),
+):
+    """
+    Run a Gemini request whose contents start with a registered prompt.
+
+    Args:
+        name: Registered prompt name
+        messages: Gemini message dicts that follow the prompt
+        generation_config: Generation config passed to the model
+        extra_parts: Text parts appended to the prompt message (e.g. a summary)
+
+    Returns:
+        The Gemini response object
+    """
+    contents, cached_content = await _contents(name, messages, extra_parts)
+    try:
+        return await llm_gateway.generate_content(contents, generation_config, cached_content=cached_content)
+    except Exception as e:
+        if cached_content is None:
+            raise
+        logger.warning(f"Request with cached prompt {name} failed, retrying inline: {str(e)}")
+        registry.invalidate_context_cache(name)
+        contents = [registry.get(name).message(extra_parts)] + messages
+        return await llm_gateway.generate_content(contents, generation_config)
+
+
+async def stream_with_prompt(
+    name: str,
+    messages: List[Dict[str, Any]],
+    generation_config: Optional[Dict[str, Any]] = None,
+    extra_parts: Tuple[str, ...] = (),
+) -> AsyncIterator[str]:
+    """Streaming version of :func:`generate_with_prompt`, yielding text fragments."""
+    contents, cached_content = await _contents(name, messages, extra_parts)
+    produced = False
+    try:
+        async with contextlib.aclosing(
+            llm_gateway.stream_content(contents, generation_config, cached_content=cached_content)
+        ) as fragments:
+            async for text in fragments:
+                produced = True
+                yield text
+        return
+    except Exception as e:
+        if cached_content is None or produced:
+            raise
+        logger.warning(f"Request with cached prompt {name} failed, retrying inline: {str(e)}")
+        registry.invalidate_context_cache(name)
+
+    contents = [registry.get(name).message(extra_parts)] + messages
+    async with contextlib.aclosing(llm_gateway.stream_content(contents, generation_config)) as fragments:
+        async for text in fragments:
+            yield text
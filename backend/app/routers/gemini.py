@@ -1,9 +1,19 @@
-from fastapi import APIRouter, UploadFile, HTTPException, Form, Request, Depends, Body
+from fastapi import APIRouter, UploadFile, HTTPException, Form, Request, Response, Depends, Body, Header
 from typing import Optional, List, Dict, Any
+import asyncio
 import os
-import tempfile
 import json
-from app.utils import generate_cards, parsePDF_to_text, topic_selection, edit_flashcards
+from app.utils import generate_cards, parsePDF_to_text_async, topic_selection, edit_flashcards, edit_deck, CARD_PROMPT_VERSION
+from app.utils import stream_generate_cards, stream_topic_selection, stream_edit_flashcards
+from app.streaming import event_stream_response, resolve_format
+from app.decoding import format_card
+from app.llm_gateway import GEMINI_MODEL
+from app.pdf_text import PDF_BACKEND
+from app.uploads import SpooledUpload, MAX_PDF_UPLOAD_BYTES
+from app.cache import CACHE_DIR, LRUCache, SingleFlight, TieredCache, make_key
+from app import decks
+from app.clients import Clients, get_clients
+from app.sessions import reserve_session
 from typing import List, Dict, Any, Optional
 
 router = APIRouter(
@@ -11,44 +21,83 @@ router = APIRouter(
     tags=["gemini"],
 )
 
+# Decks generated from uploaded PDFs, keyed on the PDF bytes and the prompt/model version
+pdf_deck_cache = TieredCache(
+    directory=os.getenv("FLASHCARD_CACHE_DIR", os.path.join(CACHE_DIR, "flashcards")),
+    max_items=int(os.getenv("FLASHCARD_CACHE_MAX_ITEMS", "256")),
+    max_bytes=int(os.getenv("FLASHCARD_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+)
+
+# Decks generated from a subject, keyed on the normalized subject
+topic_deck_cache = LRUCache(
+    max_items=int(os.getenv("TOPIC_CACHE_MAX_ITEMS", "512")),
+    ttl=float(os.getenv("TOPIC_CACHE_TTL", "3600")),
+)
+topic_flight = SingleFlight()
+
+
+def normalize_subject(subject: str) -> str:
+    """Collapse whitespace and case so equivalent subjects share a cache entry."""
+    return " ".join(subject.split()).casefold()
+
 
 @router.post("/auto")
-async def auto_generate(request: Request, file: UploadFile):
+async def auto_generate(
+    request: Request,
+    response: Response,
+    file: UploadFile,
+    api_clients: Clients = Depends(get_clients),
+):
     # Check if the file is a PDF
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail="File must be a PDF")
     
     try:
-        # Create a temporary file to store the uploaded PDF
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            # Write the uploaded file content to the temporary file
-            content = await file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
-        
-        # Parse PDF to text
-        text = parsePDF_to_text(temp_file_path)
+        async with SpooledUpload(file, MAX_PDF_UPLOAD_BYTES, hash_content=True) as upload:
+            # Serve repeat uploads of the same PDF straight from the cache
+            cache_key = make_key(upload.sha256, CARD_PROMPT_VERSION, GEMINI_MODEL, PDF_BACKEND)
+            cards = await pdf_deck_cache.aget(cache_key)
+            if cards is not None:
+                return await store_deck(request, response, "auto", cards)
+
+            # Parse PDF to text
+            text = await parsePDF_to_text_async(upload.file)
         
         # Generate flashcards
-        cards = generate_cards(text)
+        cards = await generate_cards(text, api_clients=api_clients)
 
-        # Save flashcards to session
-        save_flashcards_to_session(request, "auto", cards)
-        
-        # Clean up the temporary file
-        os.unlink(temp_file_path)
-        
-        return cards
+        # Only cache successful generations so failures are retried
+        if cards:
+            await pdf_deck_cache.aset(cache_key, cards)
+
+        # Store the deck and save it to the session
+        return await store_deck(request, response, "auto", cards)
         
+    except HTTPException:
+        raise
     except Exception as e:
-        # Clean up the temporary file in case of error
-        if 'temp_file_path' in locals():
-            os.unlink(temp_file_path)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/cache/stats")
+async def cache_stats():
+    """
+    Report hit/miss counters and sizes for the flashcard caches.
+    """
+    return {
+        "pdf_decks": await asyncio.to_thread(pdf_deck_cache.stats),
+        "topic_decks": topic_deck_cache.stats(),
+        "topic_requests": topic_flight.stats(),
+    }
+
+
 @router.post("/manual")
-async def manual_generate(request: Request, subject: str = Form(...)):
+async def manual_generate(
+    request: Request,
+    response: Response,
+    subject: str = Form(...),
+    api_clients: Clients = Depends(get_clients),
+):
     """
     Generate flashcards based on a subject/topic.
     
@@ -59,37 +108,77 @@ async def manual_generate(request: Request, subject: str = Form(...)):
         dict: A dictionary containing the generated flashcards
     """
     try:
-        # Generate flashcards based on the subject
-        cards = topic_selection(subject)
-        
-        if not cards:
-            raise HTTPException(status_code=500, detail="Failed to generate flashcards")
+        subject = " ".join(subject.split())
+        cache_key = make_key(normalize_subject(subject), CARD_PROMPT_VERSION, GEMINI_MODEL)
+
+        cards = topic_deck_cache.get(cache_key)
+        if cards is None:
+            # Generate flashcards based on the subject, sharing one upstream
+            # call between concurrent requests for the same subject
+            cards = await topic_flight.do(cache_key, lambda: topic_selection(subject, api_clients=api_clients))
+
+            if not cards:
+                raise HTTPException(status_code=500, detail="Failed to generate flashcards")
+
+            topic_deck_cache.set(cache_key, cards)
         
-        # Save flashcards to session
-        save_flashcards_to_session(request, "manual", cards)
-            
-        return cards
+        # Store the deck and save it to the session
+        return await store_deck(request, response, "manual", cards)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/decks/{deck_id}")
+async def get_deck(deck_id: str):
+    """
+    Return a stored deck with its ID, version and cards.
+    """
+    deck = await decks.get_deck(deck_id)
+    if deck is None:
+        raise HTTPException(status_code=404, detail="Deck not found")
+    return deck
+
+
 @router.post("/edit")
 async def edit_flashcards_endpoint(
     request: Request,
     user_input: str = Form(...),
-    current_flashcards: str = Form(...)  # Changed from optional to required parameter
+    deck_id: Optional[str] = Form(None),
+    current_flashcards: Optional[str] = Form(None),
+    base_version: Optional[int] = Form(None),
+    api_clients: Clients = Depends(get_clients),
 ):
     """
     Edit flashcards based on user input.
     
+    With ``deck_id``, the stored deck is edited in place: only the cards the
+    instruction is about are sent to the model, and the response lists the
+    patch operations that were applied (see app.decks) with the new version.
+    Without it, the whole deck is posted in ``current_flashcards`` and the
+    whole updated deck is returned.
+    
+    Edits to a stored deck are applied one at a time. If ``base_version`` is
+    given and the deck is no longer at that version, the edit is rejected
+    with a 409 so the client can refetch the deck first.
+    
     Args:
         user_input (str): User instructions for modifying the flashcards
+        deck_id (str): ID of a stored deck (from the X-Deck-Id header)
         current_flashcards (str): JSON string of current flashcards from Zustand store
+        base_version (int): Version of the stored deck the edit was made against
         
     Returns:
-        dict: A dictionary containing the updated flashcards
+        dict: {"deck_id", "version", "operations"} for stored decks, otherwise
+        the updated flashcards
     """
+    if deck_id is not None:
+        return await edit_stored_deck(request, deck_id, user_input, base_version, api_clients)
+    if current_flashcards is None:
+        raise HTTPException(status_code=400, detail="Either deck_id or current_flashcards is required")
+
     try:
         # Parse the current flashcards from the request
         try:
@@ -104,15 +193,205 @@ async def edit_flashcards_endpoint(
             raise HTTPException(status_code=400, detail="No flashcards provided to edit")
         
         # Match the parameter order with utils.py implementation
-        updated_flashcards = edit_flashcards(flashcards, user_input)
+        updated_flashcards = await edit_flashcards(flashcards, user_input, api_clients)
         
         return updated_flashcards
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error editing flashcards: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/auto/stream")
+async def auto_generate_stream(
+    request: Request,
+    file: UploadFile,
+    format: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    api_clients: Clients = Depends(get_clients),
+):
+    """
+    Streaming version of /auto: each flashcard is sent as soon as it is generated.
+    
+    Events are sent as NDJSON by default, or as Server-Sent Events with
+    ?format=sse (or Accept: text/event-stream). Each "card" event carries
+    the card and its index, and a final "done" event carries the count.
+    """
+    stream_format = resolve_format(format, accept)
+    if not file.filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="File must be a PDF")
+
+    try:
+        async with SpooledUpload(file, MAX_PDF_UPLOAD_BYTES, hash_content=True) as upload:
+            cache_key = make_key(upload.sha256, CARD_PROMPT_VERSION, GEMINI_MODEL, PDF_BACKEND)
+            cards = await pdf_deck_cache.aget(cache_key)
+            if cards is None:
+                text = await parsePDF_to_text_async(upload.file)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if cards is not None:
+        return event_stream_response(card_events(iterate_cards(cards), save_deck(request, "auto")), stream_format)
+
+    save_to_session = save_deck(request, "auto")
+
+    async def save(deck):
+        if deck:
+            await pdf_deck_cache.aset(cache_key, [format_card(card) for card in deck])
+        return await save_to_session(deck)
+
+    return event_stream_response(card_events(stream_generate_cards(text, api_clients=api_clients), save), stream_format)
+
+
+@router.post("/manual/stream")
+async def manual_generate_stream(
+    request: Request,
+    subject: str = Form(...),
+    format: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    api_clients: Clients = Depends(get_clients),
+):
+    """
+    Streaming version of /manual: each flashcard is sent as soon as it is generated.
+    
+    Uses the same event format as /auto/stream.
+    """
+    stream_format = resolve_format(format, accept)
+    subject = " ".join(subject.split())
+    cache_key = make_key(normalize_subject(subject), CARD_PROMPT_VERSION, GEMINI_MODEL)
+
+    cards = topic_deck_cache.get(cache_key)
+    if cards is not None:
+        cards = iterate_cards(cards)
+    else:
+        # Share one upstream stream with concurrent requests for the same
+        # subject, from /manual as well as /manual/stream
+        cards = topic_flight.stream(cache_key, lambda: stream_topic_deck(subject, cache_key, api_clients))
+
+    # Server-side sessions are saved when the stream ends, so this persists
+    return event_stream_response(card_events(cards, save_deck(request, "manual")), stream_format)
+
+
+@router.post("/edit/stream")
+async def edit_flashcards_stream(
+    user_input: str = Form(...),
+    current_flashcards: str = Form(...),
+    format: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    api_clients: Clients = Depends(get_clients),
+):
+    """
+    Streaming version of /edit: the cards of the edited deck are sent as they are generated.
+    
+    Uses the same event format as /auto/stream.
+    """
+    stream_format = resolve_format(format, accept)
+    try:
+        flashcards = json.loads(current_flashcards)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid flashcards JSON format")
+    if not flashcards:
+        raise HTTPException(status_code=400, detail="No flashcards provided to edit")
+
+    return event_stream_response(card_events(stream_edit_flashcards(flashcards, user_input, api_clients)), stream_format)
+
+
+async def iterate_cards(cards):
+    for card in cards:
+        yield card
+
+
+async def stream_topic_deck(subject: str, cache_key: str, api_clients: Optional[Clients] = None):
+    """stream_topic_selection, caching the finished deck like /manual does."""
+    deck = []
+    async for card in stream_topic_selection(subject, api_clients=api_clients):
+        deck.append(card)
+        yield card
+    if deck:
+        topic_deck_cache.set(cache_key, deck)
+
+
+async def card_events(cards, on_complete=None):
+    """
+    Turn a stream of cards into "card" events followed by a "done" event.
+    
+    Every card is given an ID as it is sent. ``on_complete`` is awaited with
+    the full deck once the stream finishes; the dict it returns, if any, is
+    added to the "done" event.
+    """
+    deck = []
+    async for card in cards:
+        card = {**card, "id": decks.new_card_id()}
+        yield "card", {"index": len(deck), "card": card}
+        deck.append(card)
+    extra = None
+    if on_complete is not None:
+        extra = await on_complete(deck)
+    yield "done", {"count": len(deck), **(extra or {})}
+
+
+def save_deck(request: Request, flashcard_type: str):
+    """
+    Return a card_events callback that stores the finished deck and reports its ID.
+
+    Call it before the response starts: the deck is saved to the session
+    while streaming, so the session cookie has to go out with the headers.
+    """
+    reserve_session(request)
+
+    async def save(cards):
+        if not cards:
+            return None
+        deck = await decks.create_deck(cards, source=flashcard_type)
+        save_deck_to_session(request, flashcard_type, deck)
+        return {"deck_id": deck["id"]}
+    return save
+
+
+async def store_deck(request: Request, response: Response, flashcard_type: str, cards):
+    """Store a generated deck, save it to the session and return its cards with IDs."""
+    if not cards:
+        save_flashcards_to_session(request, flashcard_type, cards)
+        return cards
+    deck = await decks.create_deck(cards, source=flashcard_type)
+    save_deck_to_session(request, flashcard_type, deck)
+    response.headers["X-Deck-Id"] = deck["id"]
+    return deck["cards"]
+
+
+async def edit_stored_deck(
+    request: Request,
+    deck_id: str,
+    user_input: str,
+    base_version: Optional[int] = None,
+    api_clients: Optional[Clients] = None,
+):
+    async with decks.lock(deck_id):
+        deck = await decks.get_deck(deck_id)
+        if deck is None:
+            raise HTTPException(status_code=404, detail="Deck not found")
+        if base_version is not None and base_version != deck["version"]:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Deck is at version {deck['version']}, not {base_version}",
+            )
+
+        operations = await edit_deck(deck["cards"], user_input, api_clients)
+        if operations:
+            deck["cards"], operations = decks.apply_patch(deck["cards"], operations)
+            deck["version"] += 1
+            await decks.save_deck(deck)
+            # Keep the session copy in sync if this is the session's current deck
+            if request.session.get("decks", {}).get(deck["source"]) == deck_id:
+                save_flashcards_to_session(request, deck["source"], deck["cards"])
+
+    return {"deck_id": deck_id, "version": deck["version"], "operations": operations}
+
+
 # Helper function to get flashcards from session
 def get_flashcards_from_session(request: Request, flashcard_type: str) -> List[Dict[str, str]]:
     """Get flashcards from session or return empty list if not found"""
@@ -132,3 +411,7 @@ def save_flashcards_to_session(request: Request, flashcard_type: str, flashcards
     
     request.session["flashcards"][flashcard_type] = flashcards
 
+def save_deck_to_session(request: Request, flashcard_type: str, deck: Dict[str, Any]):
+    """Save a stored deck's cards and ID to session"""
+    save_flashcards_to_session(request, flashcard_type, deck["cards"])
+    request.session.setdefault("decks", {})[flashcard_type] = deck["id"]
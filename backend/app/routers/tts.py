@@ -1,14 +1,27 @@
-from fastapi import APIRouter, HTTPException, Body, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, Body, Depends, UploadFile, File, Form, Header, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse
-from typing import Optional, List, Dict
+from fastapi.websockets import WebSocketState
+from typing import Any, Optional, List, Dict
+import asyncio
+import base64
+import contextlib
 import os
 import logging
 import traceback
 import sys
 import json
+import re
 from pydantic import BaseModel
 # Import utility functions
-from app.routers.utils.tts_utils import generate_speech_from_text, transcribe_speech_from_audio, llm_learner_response, evaluate
+from app.uploads import SpooledUpload, MAX_AUDIO_UPLOAD_BYTES
+from app import conversations
+from app.clients import Clients, get_clients
+from app.routers.utils import incremental_evaluation
+from app.streaming import event_stream_response, resolve_format
+from app.routers.utils.tts_utils import generate_speech_from_text, stream_speech_from_text, pipeline_speech_from_segments, split_sentences, speech_cache_key, transcribe_speech_from_audio, llm_learner_response, evaluate, audio_cache
+from app.routers.utils.tts_utils import evaluate_batch, EVALUATION_BATCH_CONCURRENCY, EVALUATION_BATCH_MAX_ITEMS
+from app.routers.utils.tts_utils import stream_learner_response, synthesize_segment, SentenceSegmenter, TTS_PIPELINE_CONCURRENCY
+from app.routers.utils.tts_utils import stream_transcribe, streaming_recognition_config, STT_STREAM_ENCODING, STT_STREAM_SAMPLE_RATE
 
 # Set up logger
 logger = logging.getLogger("tts_router")
@@ -24,9 +37,33 @@ router = APIRouter(
     tags=["text-to-speech"]
 )
 
+# Cache keys are hex SHA-256 digests
+AUDIO_ID_PATTERN = re.compile(r"[0-9a-f]{64}")
+AUDIO_CHUNK_SIZE = 64 * 1024
+
 class TTSRequest(BaseModel):
     text: str
     language: Optional[str] = "en"
+    # Relay audio chunks as OpenAI produces them instead of waiting for the full clip
+    stream: Optional[bool] = False
+    # Split long text into sentences and synthesize them in parallel
+    pipelined: Optional[bool] = False
+
+class ConversationRequest(BaseModel):
+    # Earlier messages to start from, as {"role", "content"} objects
+    messages: Optional[List[Dict[str, Any]]] = None
+    language_code: Optional[str] = "en-US"
+
+class EvaluationBatchItem(BaseModel):
+    # Echoed back in the item's result
+    id: Optional[str] = None
+    # {"role", "content"} objects, or a JSON string of them
+    chat_history: Any
+
+class EvaluationBatchRequest(BaseModel):
+    items: List[EvaluationBatchItem]
+    # Transcripts scored at once, capped at EVALUATION_BATCH_CONCURRENCY
+    concurrency: Optional[int] = None
 
 class STTRequest(BaseModel):
     language_code: Optional[str] = "en-US"
@@ -40,19 +77,48 @@ class STTRequest(BaseModel):
 #     return await generate_speech(text, language)
 
 @router.post("/generate")
-async def generate_speech_post(request: TTSRequest = Body(...)):
+async def generate_speech_post(
+    request: TTSRequest = Body(...),
+    range_header: Optional[str] = Header(None, alias="Range"),
+    api_clients: Clients = Depends(get_clients),
+):
     """
     Generate speech from text using Google Text-to-Speech (POST version)
     """
     text = request.text
     # Sanitize text to prevent JSON string breaking
     # Replace problematic characters and escape sequences
-    return await generate_speech(text, request.language)
+    # Split once: the segments decide the mode and are what gets synthesized
+    segments = split_sentences(text) if request.pipelined else []
+    if len(segments) > 1:
+        return await pipeline_speech(segments, request.language, api_clients)
+    if request.stream:
+        return await stream_speech(text, request.language, api_clients)
+    return await generate_speech(text, request.language, range_header, api_clients)
+
+@router.get("/audio/{audio_id}")
+async def get_cached_audio(
+    audio_id: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+):
+    """
+    Serve a previously synthesized clip from the audio cache.
+    
+    The ID is returned in the X-Audio-Id header of /generate responses, so
+    audio elements can seek through a clip with Range requests.
+    """
+    if not AUDIO_ID_PATTERN.fullmatch(audio_id):
+        raise HTTPException(status_code=404, detail="Audio not found")
+    audio_path = await asyncio.to_thread(audio_cache.get_path, audio_id)
+    if audio_path is None:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    return serve_audio_file(audio_path, range_header, {"X-Audio-Id": audio_id})
 
 @router.post("/transcribe")
 async def transcribe_speech(
     audio_file: UploadFile = File(...),
-    language_code: str = "en-US"
+    language_code: str = "en-US",
+    api_clients: Clients = Depends(get_clients),
 ):
     """
     Transcribe speech from audio file using Google Cloud Speech-to-Text API
@@ -60,18 +126,22 @@ async def transcribe_speech(
     try:
         logger.debug(f"Received audio file: {audio_file.filename}, content_type: {audio_file.content_type}")
         
-        # Read the uploaded file
-        audio_content = await audio_file.read()
+        # Read the upload Starlette spooled, enforcing the size limit
+        async with SpooledUpload(audio_file, MAX_AUDIO_UPLOAD_BYTES) as upload:
+            audio_content = await upload.read_bytes()
         logger.debug(f"Audio content size: {len(audio_content)} bytes")
         
         # Use the utility function for transcription
         transcriptions = await transcribe_speech_from_audio(
             audio_content=audio_content,
-            language_code=language_code
+            language_code=language_code,
+            api_clients=api_clients,
         )
         
         return {"transcriptions": transcriptions}
             
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = f"Error in transcribe_speech: {str(e)}"
         logger.error(error_msg)
@@ -80,11 +150,155 @@ async def transcribe_speech(
 
 
 
+def send_after_close(websocket: WebSocket, error: Exception) -> bool:
+    """
+    Whether ``error`` is Starlette refusing to send on a closed socket.
+
+    A client that goes away mid-send shows up as WebSocketDisconnect, but
+    once the disconnect has been seen Starlette raises RuntimeError for any
+    further send.
+    """
+    return isinstance(error, RuntimeError) and WebSocketState.DISCONNECTED in (
+        websocket.application_state,
+        websocket.client_state,
+    )
+
+
+@router.websocket("/transcribe/stream")
+async def transcribe_speech_stream(
+    websocket: WebSocket,
+    language_code: str = "en-US",
+    encoding: str = STT_STREAM_ENCODING,
+    sample_rate_hertz: int = STT_STREAM_SAMPLE_RATE,
+    api_clients: Clients = Depends(get_clients),
+):
+    """
+    Transcribe speech while it is being recorded.
+    
+    The client sends audio as binary frames (e.g. MediaRecorder chunks) and a
+    text frame "end" when the recording stops. The server replies with JSON
+    events as recognition progresses:
+    
+    - {"event": "partial", "transcript", "stability"}: interim hypothesis
+    - {"event": "final", "transcript", "confidence"}: finished segment
+    - {"event": "done", "transcript"}: all final segments, then the socket closes
+    - {"event": "error", "detail"}
+    
+    If streaming recognition fails before producing a final result, the
+    audio received so far is transcribed with the batch API once the client
+    sends "end".
+    """
+    await websocket.accept()
+    try:
+        streaming_config = streaming_recognition_config(language_code, encoding, sample_rate_hertz)
+    except ValueError as e:
+        await websocket.send_json({"event": "error", "detail": str(e)})
+        await websocket.close(code=1003)
+        return
+
+    audio = bytearray()
+    queue: asyncio.Queue = asyncio.Queue()
+    too_large = False
+
+    async def receive_audio():
+        nonlocal too_large
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect" or message.get("text") is not None:
+                    break
+                chunk = message.get("bytes")
+                if not chunk:
+                    continue
+                if len(audio) + len(chunk) > MAX_AUDIO_UPLOAD_BYTES:
+                    too_large = True
+                    break
+                # Keep a copy for the batch fallback
+                audio.extend(chunk)
+                await queue.put(chunk)
+        finally:
+            await queue.put(None)
+
+    async def audio_chunks():
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                return
+            yield chunk
+
+    receiver = asyncio.create_task(receive_audio())
+    finals = []
+    try:
+        try:
+            async for result in stream_transcribe(audio_chunks(), streaming_config, api_clients):
+                if result["is_final"]:
+                    finals.append(result["transcript"].strip())
+                    await websocket.send_json({
+                        "event": "final",
+                        "transcript": result["transcript"],
+                        "confidence": result["confidence"],
+                    })
+                else:
+                    await websocket.send_json({
+                        "event": "partial",
+                        "transcript": result["transcript"],
+                        "stability": result["stability"],
+                    })
+        except WebSocketDisconnect:
+            raise
+        except Exception as e:
+            if finals or send_after_close(websocket, e):
+                raise
+            logger.warning(f"Streaming recognition failed, falling back to batch: {str(e)}")
+            await receiver
+            if audio and not too_large:
+                for transcription in await transcribe_speech_from_audio(bytes(audio), language_code, api_clients):
+                    finals.append(transcription["transcript"].strip())
+                    await websocket.send_json({
+                        "event": "final",
+                        "transcript": transcription["transcript"],
+                        "confidence": transcription["confidence"],
+                    })
+
+        await receiver
+        if too_large:
+            await websocket.send_json({"event": "error", "detail": "Recording is too large"})
+            await websocket.close(code=1009)
+            return
+        await websocket.send_json({"event": "done", "transcript": " ".join(filter(None, finals))})
+        await websocket.close()
+
+    except WebSocketDisconnect:
+        # The client went away
+        logger.debug("Transcription stream closed by client")
+    except Exception as e:
+        if send_after_close(websocket, e):
+            logger.debug("Transcription stream closed by client")
+            return
+        error_msg = f"Error in transcribe_speech_stream: {str(e)}"
+        logger.error(error_msg)
+        logger.error(traceback.format_exc())
+        try:
+            await websocket.send_json({"event": "error", "detail": error_msg})
+            await websocket.close(code=1011)
+        except WebSocketDisconnect:
+            pass
+        except RuntimeError as close_error:
+            if not send_after_close(websocket, close_error):
+                raise
+    finally:
+        receiver.cancel()
+
 @router.post("/generate_llm_response")
 async def generate_llm_response(
     audio_file: UploadFile = File(...),
-    chat_history_json: str = Form(...),  # JSON string representation of List[Dict[str, str]]
-    language_code: str = Form("en-US")
+    chat_history_json: str = Form(...),  # JSON array of message objects (or of JSON strings of them)
+    language_code: str = Form("en-US"),
+    # Relay the reply as Gemini generates it instead of waiting for all of it
+    stream: bool = Form(False),
+    format: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    api_clients: Clients = Depends(get_clients),
 ):
     """
     Process audio speech and chat history to generate LLM text response
@@ -93,31 +307,28 @@ async def generate_llm_response(
     2. Appends the text to chat history as user message
     3. Gets LLM response as a learner
     4. Returns the LLM text response directly (not as audio)
+    
+    With stream=true the reply is streamed instead: a "transcript" event,
+    then "text" events as Gemini generates the reply, then a "done" event
+    with the full response. Events are NDJSON, or Server-Sent Events with
+    ?format=sse (or Accept: text/event-stream, which also turns streaming on).
+    
+    Clients that keep the conversation on the server should use
+    /conversations/{conversation_id}/turn instead.
     """
+    streaming = stream or format is not None or (accept is not None and "text/event-stream" in accept)
+    stream_format = resolve_format(format, accept)
     try:
         logger.debug(f"Received audio file: {audio_file.filename}, content_type: {audio_file.content_type}")
 
-        
         # Parse the JSON string into a list of message dictionaries
-        chat_history = json.loads(chat_history_json)
-        print("chat_history: ", type(chat_history), chat_history[0], type(chat_history[0]))
-        chat_history = [json.loads(message) for message in chat_history]
-        # Validate that chat_history is an array
-        if not isinstance(chat_history, list):
-            raise HTTPException(status_code=400, detail="chat_history_json must be a JSON array of message objects")
+        try:
+            chat_history = conversations.parse_messages(chat_history_json)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid chat_history_json: {str(e)}")
         
         # Convert speech to text
-        audio_content = await audio_file.read()
-        transcriptions = await transcribe_speech_from_audio(
-            audio_content=audio_content,
-            language_code=language_code
-        )
-        
-        if not transcriptions:
-            raise HTTPException(status_code=400, detail="Could not transcribe audio, please try again")
-        
-        # Get the best transcription (highest confidence)
-        full_transcription = " ".join([t["transcript"] for t in transcriptions])
+        full_transcription = await transcribe_upload(audio_file, language_code, api_clients)
         
         # Add user message to chat history using full transcription
         chat_history.append({
@@ -125,8 +336,12 @@ async def generate_llm_response(
             "content": full_transcription
         })
         
+        if streaming:
+            return event_stream_response(learner_reply_events(chat_history, full_transcription), stream_format)
+
         # Get LLM response
-        llm_response = llm_learner_response(chat_history)
+        llm_response = await llm_learner_response(chat_history)
+        incremental_evaluation.schedule(chat_history + [{"role": "assistant", "content": llm_response}])
         
         # Return the LLM text response and updated chat history
         return {
@@ -134,49 +349,532 @@ async def generate_llm_response(
             "transcribed_text": full_transcription,
         }
             
-    except json.JSONDecodeError:
-        error_msg = "Invalid JSON format for chat_history_json"
-        logger.error(error_msg)
-        raise HTTPException(status_code=400, detail=error_msg)
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = f"Error in generate_llm_response: {str(e)}"
         logger.error(error_msg)
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=error_msg)
 
+async def learner_reply_events(chat_history, transcription: str):
+    """Stream a learner reply as "text" events between "transcript" and "done"."""
+    yield "transcript", {"text": transcription}
+    reply = []
+    async with contextlib.aclosing(stream_learner_response(chat_history)) as fragments:
+        async for fragment in fragments:
+            reply.append(fragment)
+            yield "text", {"delta": fragment}
+    llm_response = "".join(reply)
+    incremental_evaluation.schedule(chat_history + [{"role": "assistant", "content": llm_response}])
+    yield "done", {"response": llm_response, "transcribed_text": transcription}
+
+@router.post("/conversations")
+async def create_conversation(request: Optional[ConversationRequest] = Body(None)):
+    """
+    Start a conversation kept on the server, optionally seeded with earlier messages.
+    """
+    request = request or ConversationRequest()
+    try:
+        messages = conversations.parse_messages(request.messages or [])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await conversations.create_conversation(messages, request.language_code)
+
+@router.get("/conversations/{conversation_id}")
+async def get_conversation(conversation_id: str):
+    conversation = await conversations.get_conversation(conversation_id)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return conversation
+
+@router.delete("/conversations/{conversation_id}")
+async def delete_conversation(conversation_id: str):
+    await conversations.delete_conversation(conversation_id)
+    return {"deleted": conversation_id}
+
+@router.post("/conversations/{conversation_id}/turn")
+async def conversation_turn(
+    conversation_id: str,
+    audio_file: UploadFile = File(...),
+    language_code: Optional[str] = Form(None),
+    api_clients: Clients = Depends(get_clients),
+):
+    """
+    Run one voice turn on a stored conversation.
+    
+    Only the new audio is uploaded: it is transcribed, the learner's reply is
+    generated from the stored history, and both are appended to the
+    conversation.
+    """
+    try:
+        async with conversations.lock(conversation_id):
+            conversation = await conversations.get_conversation(conversation_id)
+            if conversation is None:
+                raise HTTPException(status_code=404, detail="Conversation not found")
+
+            full_transcription = await transcribe_upload(
+                audio_file,
+                language_code or conversation["language_code"],
+                api_clients,
+            )
+            messages = conversation["messages"] + [{"role": "user", "content": full_transcription}]
+            llm_response = await llm_learner_response(messages)
+
+            conversation["messages"] = messages + [{"role": "assistant", "content": llm_response}]
+            await conversations.save_conversation(conversation)
+            incremental_evaluation.schedule(conversation["messages"])
+
+        return {
+            "conversation_id": conversation_id,
+            "response": llm_response,
+            "transcribed_text": full_transcription,
+            "message_count": len(conversation["messages"]),
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        error_msg = f"Error in conversation_turn: {str(e)}"
+        logger.error(error_msg)
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=error_msg)
+
+@router.post("/voice_turn")
+async def voice_turn(
+    audio_file: UploadFile = File(...),
+    chat_history_json: Optional[str] = Form(None),
+    conversation_id: Optional[str] = Form(None),
+    language_code: Optional[str] = Form(None),
+    language: str = Form("en"),
+    format: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    api_clients: Clients = Depends(get_clients),
+):
+    """
+    Run a whole voice turn (speech-to-text, learner reply, speech) in one request.
+    
+    The history comes from chat_history_json or from a stored conversation
+    (conversation_id), which is then updated like /conversations/{id}/turn:
+    the conversation stays locked from reading its history until the reply
+    is appended, so concurrent turns on it are serialized.
+    The reply is streamed from Gemini and each sentence is synthesized as
+    soon as it is complete, so audio starts before the reply is finished.
+    
+    Events are sent as NDJSON by default, or as Server-Sent Events with
+    ?format=sse (or Accept: text/event-stream):
+    
+    - "transcript": the transcribed user speech
+    - "text": a fragment of the learner's reply as it is generated
+    - "audio": a base64 MP3 clip of the next segment of the reply, in order,
+      with its text and audio ID (see /audio/{audio_id})
+    - "done": the full reply, transcription and segment count
+    """
+    stream_format = resolve_format(format, accept)
+    if (chat_history_json is None) == (conversation_id is None):
+        raise HTTPException(status_code=400, detail="Send either chat_history_json or conversation_id")
+
+    try:
+        if conversation_id is not None:
+            # Only checked here; the history is read under the lock once streaming starts
+            conversation = await conversations.get_conversation(conversation_id)
+            if conversation is None:
+                raise HTTPException(status_code=404, detail="Conversation not found")
+            language_code = language_code or conversation["language_code"]
+        else:
+            try:
+                chat_history = conversations.parse_messages(chat_history_json)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid chat_history_json: {str(e)}")
+
+        # Transcribe before the stream starts so bad audio still gets a 400
+        full_transcription = await transcribe_upload(audio_file, language_code or "en-US", api_clients)
+    except HTTPException:
+        raise
+    except Exception as e:
+        error_msg = f"Error in voice_turn: {str(e)}"
+        logger.error(error_msg)
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=error_msg)
+
+    if conversation_id is not None:
+        events = conversation_voice_turn_events(conversation_id, full_transcription, language, api_clients)
+    else:
+        messages = chat_history + [{"role": "user", "content": full_transcription}]
+        events = voice_turn_events(messages, full_transcription, language, api_clients)
+    return event_stream_response(events, stream_format)
+
+async def voice_turn_events(
+    chat_history,
+    transcription: str,
+    language: str,
+    api_clients: Optional[Clients] = None,
+    on_complete=None,
+):
+    """
+    Stream a learner reply as "text" events and its speech as "audio" events.
+    
+    Gemini's output is cut into sentence segments as it arrives; each segment
+    is synthesized right away (at most TTS_PIPELINE_CONCURRENCY at once) and
+    the clips are sent in reply order as they finish. ``on_complete`` is
+    awaited with the full reply before the "done" event.
+    """
+    yield "transcript", {"text": transcription}
+
+    events: asyncio.Queue = asyncio.Queue()
+    segments: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(TTS_PIPELINE_CONCURRENCY)
+    synthesis_tasks = []
+    reply = []
+
+    async def synthesize(text):
+        async with semaphore:
+            return await synthesize_segment(text, language, api_clients)
+
+    def schedule(text):
+        task = asyncio.create_task(synthesize(text))
+        synthesis_tasks.append(task)
+        segments.put_nowait((text, task))
+
+    async def produce_text():
+        segmenter = SentenceSegmenter()
+        try:
+            async with contextlib.aclosing(stream_learner_response(chat_history)) as fragments:
+                async for fragment in fragments:
+                    reply.append(fragment)
+                    await events.put(("text", {"delta": fragment}))
+                    for text in segmenter.feed(fragment):
+                        schedule(text)
+            for text in segmenter.flush():
+                schedule(text)
+        finally:
+            segments.put_nowait(None)
+
+    async def produce_audio():
+        index = 0
+        while (item := await segments.get()) is not None:
+            text, task = item
+            audio_id, audio = await task
+            await events.put(("audio", {
+                "index": index,
+                "text": text,
+                "audio_id": audio_id,
+                "audio": base64.b64encode(audio).decode("ascii"),
+            }))
+            index += 1
+        return index
+
+    text_task = asyncio.create_task(produce_text())
+    audio_task = asyncio.create_task(produce_audio())
+    audio_task.add_done_callback(lambda _: events.put_nowait(None))
+    try:
+        while (event := await events.get()) is not None:
+            yield event
+            if text_task.done() and text_task.exception() is not None:
+                break
+        # Surface a failed stage as the stream's error event
+        for task in (text_task, audio_task):
+            if task.done() and task.exception() is not None:
+                raise task.exception()
+        segment_count = audio_task.result()
+    finally:
+        for task in [text_task, audio_task, *synthesis_tasks]:
+            task.cancel()
+        await asyncio.gather(text_task, audio_task, *synthesis_tasks, return_exceptions=True)
+
+    llm_response = "".join(reply)
+    incremental_evaluation.schedule(chat_history + [{"role": "assistant", "content": llm_response}])
+    if on_complete is not None:
+        await on_complete(llm_response)
+    yield "done", {
+        "response": llm_response,
+        "transcribed_text": transcription,
+        "segments": segment_count,
+    }
+
+async def conversation_voice_turn_events(
+    conversation_id: str,
+    transcription: str,
+    language: str,
+    api_clients: Optional[Clients] = None,
+):
+    """
+    voice_turn_events on a stored conversation, holding its lock from reading
+    the history until the reply has been appended.
+    """
+    async with conversations.lock(conversation_id):
+        conversation = await conversations.get_conversation(conversation_id)
+        if conversation is None:
+            raise LookupError("Conversation not found")
+        messages = conversation["messages"] + [{"role": "user", "content": transcription}]
+
+        async def append_reply(llm_response):
+            conversation["messages"] = messages + [{"role": "assistant", "content": llm_response}]
+            await conversations.save_conversation(conversation)
+
+        async with contextlib.aclosing(
+            voice_turn_events(messages, transcription, language, api_clients, append_reply)
+        ) as events:
+            async for event in events:
+                yield event
+
+async def transcribe_upload(
+    audio_file: UploadFile,
+    language_code: str,
+    api_clients: Optional[Clients] = None,
+) -> str:
+    """
+    Transcribe an uploaded recording into a single string.
+    
+    Raises:
+        HTTPException: 413 if the upload is too large, 400 if nothing was recognized
+    """
+    async with SpooledUpload(audio_file, MAX_AUDIO_UPLOAD_BYTES) as upload:
+        audio_content = await upload.read_bytes()
+    transcriptions = await transcribe_speech_from_audio(
+        audio_content=audio_content,
+        language_code=language_code,
+        api_clients=api_clients,
+    )
+    
+    if not transcriptions:
+        raise HTTPException(status_code=400, detail="Could not transcribe audio, please try again")
+    
+    # Join the transcribed segments
+    return " ".join([t["transcript"] for t in transcriptions])
+
 @router.post("/evaluate")
 async def evaluate_response(
-    chat_history_json: str = Form(...)
+    chat_history_json: str = Form(...),
+    # Score from the latest checkpoint; defaults to INCREMENTAL_EVALUATION
+    incremental: Optional[bool] = Form(None),
 ):
     """
     Evaluate the quality of the chat history
+    
+    In incremental mode only the messages added since the last checkpoint
+    (see incremental_evaluation) are sent to Gemini. If that fails, the
+    whole conversation is evaluated instead.
     """
+    if incremental is None:
+        incremental = incremental_evaluation.INCREMENTAL_EVALUATION
+    if incremental:
+        try:
+            chat_history = conversations.parse_messages(chat_history_json)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid chat_history_json: {str(e)}")
+        try:
+            return await incremental_evaluation.evaluate_incremental(chat_history)
+        except Exception as e:
+            logger.error(f"Incremental evaluation failed, evaluating the whole conversation: {str(e)}")
+
+    return await evaluate(chat_history_json)
+
+@router.post("/evaluate/batch")
+async def evaluate_responses(
+    request: EvaluationBatchRequest,
+    format: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+):
+    """
+    Evaluate many chat histories, streaming each result as it completes.
+    
+    Unchanged transcripts are answered from the evaluation cache. Events are
+    NDJSON by default, or Server-Sent Events with ?format=sse (or
+    Accept: text/event-stream): a "result" event per item, in completion
+    order, with its index, id and scores (or an error), then a "done" event
+    with counts.
+    """
+    stream_format = resolve_format(format, accept)
+    if len(request.items) > EVALUATION_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {EVALUATION_BATCH_MAX_ITEMS} items per batch")
+
+    chat_histories = []
+    for index, item in enumerate(request.items):
+        try:
+            chat_histories.append(conversations.parse_messages(item.chat_history))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid chat_history in item {index}: {str(e)}")
 
-    return evaluate(chat_history_json)
+    concurrency = min(request.concurrency or EVALUATION_BATCH_CONCURRENCY, EVALUATION_BATCH_CONCURRENCY)
+    ids = [item.id for item in request.items]
 
+    async def events():
+        cached = failed = 0
+        async with contextlib.aclosing(evaluate_batch(chat_histories, concurrency)) as results:
+            async for result in results:
+                cached += bool(result.get("cached"))
+                failed += "error" in result
+                yield "result", {"id": ids[result["index"]], **result}
+        yield "done", {"count": len(chat_histories), "cached": cached, "failed": failed}
 
-async def generate_speech(text: str, language: str):
+    return event_stream_response(events(), stream_format)
+
+
+async def generate_speech(
+    text: str,
+    language: str,
+    range_header: Optional[str] = None,
+    api_clients: Optional[Clients] = None,
+):
     """
     Common function to generate speech
     """
     try:
-        # Use the utility function for speech generation
-        audio_file = await generate_speech_from_text(text, language)
-        
-        # Create a streaming response
-        async def cleanup():
-            try:
-                os.unlink(audio_file.name)
-            except Exception:
-                pass  # Ignore cleanup errors
-        
+        # Use the utility function for speech generation (served from the cache on repeats)
+        audio_path = await generate_speech_from_text(text, language, api_clients)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    audio_id = os.path.basename(audio_path)[:-len(audio_cache.suffix)]
+    return serve_audio_file(audio_path, range_header, {"X-Audio-Id": audio_id})
+
+
+async def stream_speech(text: str, language: str, api_clients: Optional[Clients] = None):
+    """
+    Stream speech straight from the upstream response, falling back to the
+    cached file when the clip has been synthesized before
+    
+    Range requests are not supported here; seek through the clip with
+    /audio/{audio_id} instead.
+    """
+    audio_id = speech_cache_key(text, language)
+    audio_path = await asyncio.to_thread(audio_cache.get_path, audio_id)
+    if audio_path is not None:
+        return serve_audio_file(audio_path, None, {"X-Audio-Id": audio_id})
+
+    chunks = stream_speech_from_text(text, language, api_clients)
+    try:
+        # Wait for the first chunk so upstream errors still produce a 500
+        first_chunk = await chunks.__anext__()
+    except StopAsyncIteration:
+        first_chunk = b""
+    except Exception as e:
+        await chunks.aclose()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def relay():
+        # Closing the upstream stream on disconnect releases its gateway slot
+        try:
+            yield first_chunk
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    return StreamingResponse(
+        relay(),
+        media_type="audio/mpeg",
+        headers={"X-Audio-Id": audio_id},
+    )
+
+
+async def pipeline_speech(segments: List[str], language: str, api_clients: Optional[Clients] = None):
+    """
+    Stream sentence segments of long text, synthesized in parallel
+    """
+    chunks = pipeline_speech_from_segments(segments, language, api_clients)
+    try:
+        # Wait for the first segment so upstream errors still produce a 500
+        first_chunk = await chunks.__anext__()
+    except Exception as e:
+        await chunks.aclose()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def relay():
+        try:
+            yield first_chunk
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    return StreamingResponse(relay(), media_type="audio/mpeg")
+
+
+def parse_range_header(range_header: str, size: int) -> Optional[tuple]:
+    """
+    Parse a single "bytes=start-end" range into inclusive offsets.
+    
+    Returns None when the header should be ignored (unsupported unit or
+    multiple ranges), in which case the whole file is served.
+    """
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+
+    start_str, _, end_str = ranges.strip().partition("-")
+    try:
+        if start_str:
+            start = int(start_str)
+            end = int(end_str) if end_str else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(size - int(end_str), 0)
+            end = size - 1
+    except ValueError:
+        return None
+
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end
+
+
+def iter_file_range(audio_file, start: int, length: int):
+    """
+    Yield ``length`` bytes of an open file starting at ``start``, then close it
+    """
+    try:
+        audio_file.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = audio_file.read(min(AUDIO_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        audio_file.close()
+
+
+def serve_audio_file(audio_path: str, range_header: Optional[str] = None, headers: Optional[Dict[str, str]] = None):
+    """
+    Stream an MP3 file with Content-Length and single-range Range support
+    """
+    try:
+        audio_file = open(audio_path, "rb")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Audio not found")
+
+    # The open handle stays valid even if the entry is evicted meanwhile
+    size = os.fstat(audio_file.fileno()).st_size
+    headers = {"Accept-Ranges": "bytes", **(headers or {})}
+
+    try:
+        byte_range = parse_range_header(range_header, size) if range_header else None
+    except HTTPException:
+        audio_file.close()
+        raise
+
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
         return StreamingResponse(
-            audio_file,
+            iter_file_range(audio_file, 0, size),
             media_type="audio/mpeg",
-            background=cleanup
+            headers=headers,
         )
-            
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
-
 
+    start, end = byte_range
+    headers["Content-Length"] = str(end - start + 1)
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return StreamingResponse(
+        iter_file_range(audio_file, start, end - start + 1),
+        status_code=206,
+        media_type="audio/mpeg",
+        headers=headers,
+    )
@@ -0,0 +1,176 @@
+"""
+Incremental evaluation of learner conversations.
+
+A full evaluation sends the whole conversation to Gemini, so the final
+/evaluate call of a long session is the slowest request we serve. With
+``INCREMENTAL_EVALUATION`` enabled, new turns are instead scored in the
+background as the conversation progresses (once at least
+``EVALUATION_DELTA_MIN_MESSAGES`` messages are unscored), and running
+aggregates of the scores are kept as checkpoints. The final evaluation only
+scores the messages added since the last checkpoint.
+
+Checkpoints are stored under a hash of the message prefix they cover (and
+the evaluation prompt version and model), like the rolling chat summaries,
+so stateless clients that resend the whole history benefit as well as
+stored conversations, and conversations that share an opening message
+never share checkpoints. Background scoring keeps the latest checkpoint
+within a few messages of the end of the conversation, so only the last
+``EVALUATION_CHECKPOINT_LOOKBACK`` prefixes are looked up. Each delta's
+scores are weighted by how much the teacher wrote in it.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app import llm_gateway
+from app.cache import SingleFlight, make_key
+from app.chat_context import prefix_keys
+from app.prompts import generate_with_prompt, registry
+from app.routers.utils.tts_utils import EVALUATION_CONFIG, EVALUATION_KEYS, gemini_messages, parse_evaluation
+from app.stores import create_store
+
+logger = logging.getLogger(__name__)
+
+INCREMENTAL_EVALUATION = os.getenv("INCREMENTAL_EVALUATION", "false").lower() in ("1", "true", "yes")
+# Unscored messages needed before a background delta evaluation runs
+EVALUATION_DELTA_MIN_MESSAGES = int(os.getenv("EVALUATION_DELTA_MIN_MESSAGES", "4"))
+# Already-scored messages sent before a delta so the evaluator has context
+EVALUATION_DELTA_CONTEXT_MESSAGES = int(os.getenv("EVALUATION_DELTA_CONTEXT_MESSAGES", "4"))
+
+EVALUATION_CHECKPOINT_BACKEND = os.getenv("EVALUATION_CHECKPOINT_BACKEND", "memory")
+EVALUATION_CHECKPOINT_TTL = float(os.getenv("EVALUATION_CHECKPOINT_TTL", str(6 * 60 * 60)))
+EVALUATION_CHECKPOINT_MAX_ITEMS = int(os.getenv("EVALUATION_CHECKPOINT_MAX_ITEMS", "10000"))
+# How many of the most recent prefixes are checked for a checkpoint
+EVALUATION_CHECKPOINT_LOOKBACK = int(
+    os.getenv("EVALUATION_CHECKPOINT_LOOKBACK", str(2 * EVALUATION_DELTA_MIN_MESSAGES))
+)
+
+checkpoint_store = create_store(
+    EVALUATION_CHECKPOINT_BACKEND,
+    table="evaluation_checkpoints",
+    ttl=EVALUATION_CHECKPOINT_TTL,
+    max_items=EVALUATION_CHECKPOINT_MAX_ITEMS,
+)
+checkpoint_flight = SingleFlight()
+_background_evaluations = set()
+
+
+async def _call_store(method, *args):
+    if checkpoint_store.blocking:
+        return await run_in_threadpool(method, *args)
+    return method(*args)
+
+
+def _checkpoint_key(prefix_key: str) -> str:
+    return make_key(prefix_key, registry.get("evaluation").version, llm_gateway.GEMINI_MODEL)
+
+
+def _latest_checkpoint(keys: List[str], end: int) -> Tuple[int, Optional[Dict[str, Any]]]:
+    """Find the longest of the last EVALUATION_CHECKPOINT_LOOKBACK prefixes up to ``end`` messages with a checkpoint."""
+    for covered in range(end, max(0, end - EVALUATION_CHECKPOINT_LOOKBACK), -1):
+        checkpoint = checkpoint_store.get(_checkpoint_key(keys[covered]))
+        if checkpoint is not None:
+            return covered, checkpoint
+    return 0, None
+
+
+def delta_weight(messages: List[Dict[str, str]]) -> int:
+    """Weight of a delta's scores: the characters the teacher wrote in it."""
+    return max(1, sum(len(message.get("content", "")) for message in messages if message.get("role") == "user"))
+
+
+def checkpoint_scores(checkpoint: Dict[str, Any]) -> Dict[str, int]:
+    return {key: int(round(checkpoint["totals"][key] / checkpoint["weight"])) for key in EVALUATION_KEYS}
+
+
+async def _score_delta(messages: List[Dict[str, str]], start: int, end: int) -> Dict[str, int]:
+    """Score ``messages[start:end]``, with a few earlier messages as context."""
+    context = messages[max(0, start - EVALUATION_DELTA_CONTEXT_MESSAGES):start]
+    extra_parts = ()
+    if context:
+        extra_parts = (
+            f"This is an incremental evaluation. The first {len(context)} messages of the chat history "
+            "were already assessed and are included only as context: score the teacher only on the "
+            "messages that follow them.",
+        )
+    response = await generate_with_prompt(
+        "evaluation",
+        gemini_messages(context + messages[start:end]),
+        EVALUATION_CONFIG,
+        extra_parts,
+    )
+    return parse_evaluation(response.text)
+
+
+async def _advance(messages: List[Dict[str, str]], keys: List[str], end: int) -> Dict[str, Any]:
+    """Checkpoint ``messages[:end]``, scoring only what the latest checkpoint doesn't cover."""
+    covered, checkpoint = await _call_store(_latest_checkpoint, keys, end)
+    if covered == end:
+        return checkpoint
+
+    scores = await _score_delta(messages, covered, end)
+    weight = delta_weight(messages[covered:end])
+    totals = checkpoint["totals"] if checkpoint else {key: 0 for key in EVALUATION_KEYS}
+    checkpoint = {
+        "messages": end,
+        "weight": (checkpoint["weight"] if checkpoint else 0) + weight,
+        "totals": {key: totals[key] + scores[key] * weight for key in EVALUATION_KEYS},
+    }
+    await _call_store(checkpoint_store.set, _checkpoint_key(keys[end]), checkpoint)
+    return checkpoint
+
+
+def schedule(chat_history: List[Dict[str, str]]):
+    """
+    Score the unscored turns of a conversation in the background.
+
+    Does nothing unless ``INCREMENTAL_EVALUATION`` is enabled, or while fewer
+    than ``EVALUATION_DELTA_MIN_MESSAGES`` messages are unscored.
+    """
+    if not INCREMENTAL_EVALUATION:
+        return
+    messages = [message for message in chat_history if message.get("role") != "system"]
+    end = len(messages)
+    if end < EVALUATION_DELTA_MIN_MESSAGES:
+        return
+    keys = prefix_keys(messages)
+
+    async def advance():
+        try:
+            covered, _ = await _call_store(_latest_checkpoint, keys, end)
+            if end - covered >= EVALUATION_DELTA_MIN_MESSAGES:
+                await checkpoint_flight.do(keys[end], lambda: _advance(messages, keys, end))
+        except Exception as e:
+            logger.error(f"Error evaluating new turns: {str(e)}")
+
+    task = asyncio.ensure_future(advance())
+    _background_evaluations.add(task)
+    task.add_done_callback(_background_evaluations.discard)
+
+
+async def evaluate_incremental(chat_history: List[Dict[str, str]]) -> Dict[str, int]:
+    """
+    Evaluate a conversation from its latest checkpoint.
+
+    Only the messages after the checkpoint are sent to Gemini; with no
+    checkpoint the whole conversation is scored as one delta.
+
+    Args:
+        chat_history: A list of {"role", "content"} message dictionaries
+
+    Returns:
+        A dictionary with evaluation scores
+
+    Raises:
+        ValueError: If the conversation has no messages to evaluate
+    """
+    messages = [message for message in chat_history if message.get("role") != "system"]
+    if not messages:
+        raise ValueError("Chat history has no messages to evaluate")
+    keys = prefix_keys(messages)
+    end = len(messages)
+    checkpoint = await checkpoint_flight.do(keys[end], lambda: _advance(messages, keys, end))
+    return checkpoint_scores(checkpoint)
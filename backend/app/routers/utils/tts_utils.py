@@ -1,17 +1,22 @@
+import asyncio
+import contextlib
 import os
+import re
 import tempfile
 import logging
 import sys
 import traceback
-from typing import Dict, List, Optional, Union, BinaryIO
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union, BinaryIO
 from gtts import gTTS
 from google.cloud import speech
 import io
-from dotenv import load_dotenv
-import google.generativeai as genai
 import typing_extensions as typing
 import json
-from openai import OpenAI
+from app import audio_probe, clients, llm_gateway, transcode
+from app.chat_context import rolling_context
+from app.prompts import generate_with_prompt, registry, stream_with_prompt
+from app.cache import CACHE_DIR, DiskCache, SingleFlight, TieredCache, make_key
+from app.decoding import json_config, parse_object
 
 # Set up logger
 logger = logging.getLogger("tts_utils")
@@ -22,46 +27,318 @@ formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(messag
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
-async def generate_speech_from_text(text: str, language: str = "en") -> BinaryIO:
+# OpenAI Text-to-Speech settings
+TTS_MODEL = "gpt-4o-mini-tts"
+TTS_VOICE = "coral"
+TTS_INSTRUCTIONS = "Speak in a pick-me-girl tone."
+
+# Size of the chunks relayed from OpenAI when streaming
+TTS_STREAM_CHUNK_SIZE = 4096
+
+# Streaming recognition defaults match browser MediaRecorder output (Opus in WebM).
+# Google limits each streamed request to 25 KB of audio.
+STT_STREAM_ENCODING = os.getenv("STT_STREAM_ENCODING", "WEBM_OPUS")
+STT_STREAM_SAMPLE_RATE = int(os.getenv("STT_STREAM_SAMPLE_RATE", "48000"))
+STT_STREAM_MAX_REQUEST_BYTES = 25 * 1024
+
+# Pipelined synthesis: segments shorter than this are merged with the next
+# sentence, and at most this many segments are synthesized at once
+TTS_SEGMENT_MIN_CHARS = int(os.getenv("TTS_SEGMENT_MIN_CHARS", "80"))
+TTS_PIPELINE_CONCURRENCY = int(os.getenv("TTS_PIPELINE_CONCURRENCY", "4"))
+
+# Whitespace following sentence-ending punctuation (and any closing quotes/brackets)
+SENTENCE_BOUNDARY = re.compile(r'(?:(?<=[.!?…])|(?<=[.!?…]["\')\]”’]))\s+')
+
+# Generation settings for the learner's replies
+LEARNER_CONFIG = {
+    "temperature": 0.7,  # Slightly higher temperature for more conversational responses
+    "top_p": 0.85,
+    "top_k": 40,
+    "max_output_tokens": 800,
+}
+
+# Synthesized clips, keyed on everything that affects the audio
+audio_cache = DiskCache(
+    directory=os.getenv("TTS_CACHE_DIR", os.path.join(CACHE_DIR, "tts")),
+    max_bytes=int(os.getenv("TTS_CACHE_MAX_BYTES", str(512 * 1024 * 1024))),
+    suffix=".mp3",
+)
+
+# Evaluation scores, keyed on the normalized transcript and the prompt/model version
+evaluation_cache = TieredCache(
+    directory=os.getenv("EVALUATION_CACHE_DIR", os.path.join(CACHE_DIR, "evaluations")),
+    max_items=int(os.getenv("EVALUATION_CACHE_MAX_ITEMS", "1024")),
+    max_bytes=int(os.getenv("EVALUATION_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+)
+evaluation_flight = SingleFlight()
+
+# Batch evaluation: most transcripts scored at once per batch, and most transcripts per batch
+EVALUATION_BATCH_CONCURRENCY = int(os.getenv("EVALUATION_BATCH_CONCURRENCY", "8"))
+EVALUATION_BATCH_MAX_ITEMS = int(os.getenv("EVALUATION_BATCH_MAX_ITEMS", "500"))
+
+
+def speech_cache_key(
+    text: str,
+    language: str = "en",
+    voice: str = TTS_VOICE,
+    model: str = TTS_MODEL,
+    instructions: str = TTS_INSTRUCTIONS,
+) -> str:
+    """
+    Build the audio cache key for a synthesis request
+    """
+    return make_key(text, voice, model, instructions, language)
+
+
+async def generate_speech_from_text(
+    text: str,
+    language: str = "en",
+    api_clients: Optional[clients.Clients] = None,
+) -> str:
     """
     Generate speech audio from text using OpenAI Text-to-Speech
     
+    Repeated requests are served from the on-disk audio cache without
+    calling OpenAI.
+    
     Args:
         text: The text to convert to speech
         language: The language code (default: "en")
+        api_clients: Shared upstream clients (defaults to clients.current())
         
     Returns:
-        An audio file object
+        The path of the cached MP3 file
     """
+    key = speech_cache_key(text, language)
+    cached_path = await asyncio.to_thread(audio_cache.get_path, key)
+    if cached_path is not None:
+        logger.debug(f"TTS cache hit: {key}")
+        return cached_path
+
     try:
-        # Load OpenAI API key from environment
-        load_dotenv()
+        # Shared OpenAI client
+        client = (api_clients or clients.current()).openai_client
         
-        # Initialize OpenAI client
-        client = OpenAI()
-        
-        # Create a temporary file to store the audio
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as temp_file:
-            # Generate speech using OpenAI
+        # Write the audio next to the cache so it can be moved into place atomically
+        fd, temp_path = tempfile.mkstemp(dir=audio_cache.directory, suffix=".tmp")
+        os.close(fd)
+
+        # Generate speech using OpenAI
+        def synthesize():
             with client.audio.speech.with_streaming_response.create(
-                model="gpt-4o-mini-tts",
-                voice="coral",
+                model=TTS_MODEL,
+                voice=TTS_VOICE,
                 input=text,
-                instructions="Speak in a pick-me-girl tone."
+                instructions=TTS_INSTRUCTIONS
             ) as response:
-                response.stream_to_file(temp_file.name)
-            
-            # Return the file object
-            return open(temp_file.name, 'rb')
+                response.stream_to_file(temp_path)
+
+        try:
+            await llm_gateway.run_blocking("openai", synthesize)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+        return await asyncio.to_thread(audio_cache.commit, key, temp_path)
             
     except Exception as e:
         logger.error(f"Error in generate_speech_from_text: {str(e)}")
         logger.error(traceback.format_exc())
         raise Exception(f"Failed to generate speech: {str(e)}")
 
+async def stream_speech_from_text(
+    text: str,
+    language: str = "en",
+    api_clients: Optional[clients.Clients] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Stream speech audio from OpenAI Text-to-Speech as it is synthesized
+    
+    Chunks are relayed as soon as OpenAI sends them, without a temp file.
+    The upstream body is read ahead of the client, so the OpenAI
+    concurrency slot is released as soon as OpenAI is done rather than
+    when a slow client is. Once the stream completes the clip is stored in
+    the audio cache so repeats are served from disk. Closing the iterator
+    early closes the upstream stream.
+    
+    Args:
+        text: The text to convert to speech
+        language: The language code (default: "en")
+        api_clients: Shared upstream clients (defaults to clients.current())
+        
+    Yields:
+        MP3 audio chunks
+    """
+    key = speech_cache_key(text, language)
+    # Chunks, then None at the end of the clip (or the upstream error)
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def fetch():
+        chunks = []
+        try:
+            client = (api_clients or clients.current()).async_openai_client
+            async with llm_gateway.limit("openai"):
+                async with client.audio.speech.with_streaming_response.create(
+                    model=TTS_MODEL,
+                    voice=TTS_VOICE,
+                    input=text,
+                    instructions=TTS_INSTRUCTIONS
+                ) as response:
+                    async for chunk in response.iter_bytes(TTS_STREAM_CHUNK_SIZE):
+                        chunks.append(chunk)
+                        queue.put_nowait(chunk)
+        except Exception as e:
+            queue.put_nowait(e)
+            return
+        if chunks:
+            await asyncio.to_thread(audio_cache.set_bytes, key, b"".join(chunks))
+        queue.put_nowait(None)
+
+    reader = asyncio.create_task(fetch())
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                logger.error(f"Error in stream_speech_from_text: {str(chunk)}")
+                logger.error("".join(traceback.format_exception(chunk)))
+                raise Exception(f"Failed to generate speech: {str(chunk)}")
+            yield chunk
+    finally:
+        # Only still running if the client went away mid-clip
+        reader.cancel()
+
+def split_sentences(text: str, min_chars: int = TTS_SEGMENT_MIN_CHARS) -> List[str]:
+    """
+    Split text at sentence boundaries into segments of at least ``min_chars``
+    
+    Short sentences are merged with the following ones so each synthesis
+    call carries enough text to sound natural.
+    """
+    segments = []
+    current = ""
+    for sentence in SENTENCE_BOUNDARY.split(text.strip()):
+        current = f"{current} {sentence}" if current else sentence
+        if len(current) >= min_chars:
+            segments.append(current)
+            current = ""
+    if current:
+        if segments and len(current) < min_chars:
+            segments[-1] = f"{segments[-1]} {current}"
+        else:
+            segments.append(current)
+    return segments
+
+
+class SentenceSegmenter:
+    """
+    Incremental version of split_sentences for text that arrives in fragments.
+    
+    :meth:`feed` returns the segments completed by a fragment and
+    :meth:`flush` returns the rest once the text is complete. The first
+    segment is cut at the first sentence boundary whatever its length, so
+    synthesis of a streamed reply can start as early as possible.
+    """
+
+    def __init__(self, min_chars: int = TTS_SEGMENT_MIN_CHARS):
+        self.min_chars = min_chars
+        self._pending = ""
+        self._current = ""
+        self._emitted = 0
+
+    def feed(self, text: str) -> List[str]:
+        self._pending += text
+        *sentences, self._pending = SENTENCE_BOUNDARY.split(self._pending)
+        segments = []
+        for sentence in sentences:
+            self._current = f"{self._current} {sentence}" if self._current else sentence
+            if len(self._current) >= self.min_chars or not self._emitted:
+                segments.append(self._current.strip())
+                self._current = ""
+                self._emitted += 1
+        return [segment for segment in segments if segment]
+
+    def flush(self) -> List[str]:
+        rest = f"{self._current} {self._pending}".strip()
+        self._current = self._pending = ""
+        return [rest] if rest else []
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
+
+
+async def synthesize_segment(
+    text: str,
+    language: str = "en",
+    api_clients: Optional[clients.Clients] = None,
+) -> Tuple[str, bytes]:
+    """
+    Synthesize one segment through the audio cache.
+    
+    Returns:
+        The clip's audio ID (see /audio/{audio_id}) and its MP3 bytes
+    """
+    path = await generate_speech_from_text(text, language, api_clients)
+    return speech_cache_key(text, language), await asyncio.to_thread(_read_file, path)
+
+
+async def pipeline_speech_from_segments(
+    segments: List[str],
+    language: str = "en",
+    api_clients: Optional[clients.Clients] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Synthesize text split by split_sentences, in parallel, as one audio stream
+    
+    Segments are synthesized concurrently (at most TTS_PIPELINE_CONCURRENCY
+    at a time) and yielded in order, so playback can start as soon as the
+    first segment is ready. Each segment goes through the audio cache.
+    
+    Args:
+        segments: The sentences of the text, from split_sentences
+        language: The language code (default: "en")
+        api_clients: Shared upstream clients (defaults to clients.current())
+        
+    Yields:
+        MP3 audio, one chunk per segment
+    """
+    semaphore = asyncio.Semaphore(TTS_PIPELINE_CONCURRENCY)
+
+    async def synthesize(segment: str) -> bytes:
+        async with semaphore:
+            _, audio = await synthesize_segment(segment, language, api_clients)
+        return audio
+
+    tasks = [asyncio.create_task(synthesize(segment)) for segment in segments]
+    try:
+        for task in tasks:
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def recognition_config(info: audio_probe.AudioInfo, language_code: str) -> speech.RecognitionConfig:
+    """Build a RecognitionConfig that matches a probed recording exactly."""
+    config = speech.RecognitionConfig(
+        encoding=speech.RecognitionConfig.AudioEncoding[info.encoding],
+        language_code=language_code,
+        audio_channel_count=info.channels or 1,
+        enable_automatic_punctuation=True,
+        model="default",
+        use_enhanced=True  # Use enhanced model for better accuracy
+    )
+    if info.sample_rate:
+        config.sample_rate_hertz = info.sample_rate
+    return config
+
+
 async def transcribe_speech_from_audio(
     audio_content: bytes, 
-    language_code: str = "en-US"
+    language_code: str = "en-US",
+    api_clients: Optional[clients.Clients] = None,
 ) -> List[Dict[str, Union[str, float, int]]]:
     """
     Transcribe speech from audio bytes using Google Cloud Speech-to-Text API
@@ -69,6 +346,7 @@ async def transcribe_speech_from_audio(
     Args:
         audio_content: The audio content as bytes
         language_code: The language code (default: "en-US")
+        api_clients: Shared upstream clients (defaults to clients.current())
         
     Returns:
         A list of transcription results with transcript and confidence score
@@ -76,124 +354,50 @@ async def transcribe_speech_from_audio(
     try:
         logger.debug(f"Processing audio content of size: {len(audio_content)} bytes")
         
-        # Analyze audio header bytes for more accurate format detection
-        format_info = "Unknown"
-        encoding = speech.RecognitionConfig.AudioEncoding.LINEAR16  # Default to LINEAR16 (WAV)
+        # Read the container and codec headers to configure recognition exactly,
+        # converting up front whatever Speech-to-Text can't decode as is
+        info = audio_probe.probe(audio_content)
+        logger.debug(f"Audio format: {info}")
+        if info.encoding is None:
+            try:
+                audio_content = await transcode.to_linear16(audio_content)
+                info = audio_probe.AudioInfo("raw", "pcm_s16le", "LINEAR16", transcode.TRANSCODE_SAMPLE_RATE, 1, 16)
+            except transcode.TranscodeError as e:
+                # Without ffmpeg the best guess is raw PCM, as before
+                logger.warning(f"Could not convert {info.container}/{info.codec} audio, sending it as LINEAR16: {str(e)}")
+                info = audio_probe.AudioInfo("raw", "unknown", "LINEAR16")
         
-        if len(audio_content) > 12:
-            header = audio_content[:12]
-            header_hex = ' '.join(f'{b:02x}' for b in header)
-            logger.debug(f"Audio file header (hex): {header_hex}")
-            
-            # WAV file detection
-            if header.startswith(b'RIFF') and b'WAVE' in header:
-                format_info = "WAV format detected from header"
-                encoding = speech.RecognitionConfig.AudioEncoding.LINEAR16
-            # MP3 detection
-            elif header.startswith(b'\xFF\xFB') or header.startswith(b'ID3'):
-                format_info = "MP3 format detected from header"
-                encoding = speech.RecognitionConfig.AudioEncoding.MP3
-            # WebM detection
-            elif header.startswith(b'\x1A\x45\xDF\xA3'):
-                format_info = "WebM format detected from header"
-                encoding = speech.RecognitionConfig.AudioEncoding.WEBM_OPUS
+        # Shared Speech-to-Text client
+        client = (api_clients or clients.current()).speech_client
         
-        logger.debug(f"Audio format analysis: {format_info}")
+        # Configure the recognition
+        logger.debug(f"Configuring recognition with language code: {language_code}")
+        config = recognition_config(info, language_code)
         
-        # Create a temporary file to store the audio
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_file:
-            logger.debug(f"Created temporary file: {temp_file.name}")
-            temp_file.write(audio_content)
-            temp_file.flush()
-            
-            # Initialize the client
-            logger.debug("Initializing Google Speech-to-Text client")
-            client = speech.SpeechClient()
-            
-            # Configure the recognition
-            logger.debug(f"Configuring recognition with language code: {language_code}")
-            
-            config = speech.RecognitionConfig(
-                encoding=encoding,
-                language_code=language_code,
-                audio_channel_count=1,
-                enable_automatic_punctuation=True,
-                model="default",
-                use_enhanced=True  # Use enhanced model for better accuracy
-            )
-            
-            # Create the audio object
-            audio = speech.RecognitionAudio(content=audio_content)
-            
-            # Perform the transcription
-            logger.debug(f"Sending request to Google Speech-to-Text API")
-            
-            try:
-                response = client.recognize(config=config, audio=audio)
-                # logger.debug(f"Received response from Google: {response}")
-            except Exception as speech_error:
-                # Try to convert to a standard WAV format using ffmpeg if available
-                logger.warning(f"First transcription attempt failed: {str(speech_error)}")
-                logger.debug("Attempting to convert audio to standard WAV format")
-                
-                try:
-                    import subprocess
-                    converted_file = f"{temp_file.name}_converted.wav"
-                    
-                    # Try to convert using ffmpeg (if installed)
-                    cmd = ["ffmpeg", "-y", "-i", temp_file.name, "-acodec", "pcm_s16le", "-ar", "16000", "-ac", "1", converted_file]
-                    logger.debug(f"Running conversion command: {' '.join(cmd)}")
-                    
-                    process = subprocess.run(cmd, capture_output=True, text=True)
-                    if process.returncode != 0:
-                        logger.error(f"Conversion failed: {process.stderr}")
-                        raise Exception(f"Audio conversion failed: {process.stderr}")
-                    
-                    logger.debug(f"Conversion successful, using converted file: {converted_file}")
-                    
-                    # Read the converted file and try again
-                    with open(converted_file, "rb") as conv_file:
-                        converted_content = conv_file.read()
-                    
-                    audio = speech.RecognitionAudio(content=converted_content)
-                    config = speech.RecognitionConfig(
-                        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,  # Standard WAV
-                        language_code=language_code,
-                        sample_rate_hertz=16000,
-                        audio_channel_count=1,
-                        enable_automatic_punctuation=True,
-                    )
-                    
-                    response = client.recognize(config=config, audio=audio)
-                    # logger.debug(f"Received response from Google after conversion: {response}")
-                    
-                    # Clean up the converted file
-                    os.unlink(converted_file)
-                except Exception as conv_error:
-                    logger.error(f"Audio conversion attempt failed: {str(conv_error)}")
-                    raise speech_error  # Re-raise the original error if conversion fails
-            
-            # Clean up the temporary file
-            os.unlink(temp_file.name)
-            logger.debug(f"Cleaned up temporary file: {temp_file.name}")
-            
-            # Process the response
-            transcriptions = []
-            for result in response.results:
-                for alternative in result.alternatives:
-                    transcription = {
-                        "transcript": alternative.transcript,
-                        "confidence": alternative.confidence,
-                        "channel_tag": 0  # Default to 0 since we're using mono
-                    }
-                    transcriptions.append(transcription)
-                    logger.debug(f"Added transcription: {transcription}")
+        # Create the audio object
+        audio = speech.RecognitionAudio(content=audio_content)
+        
+        # Perform the transcription
+        logger.debug(f"Sending request to Google Speech-to-Text API")
+        response = await llm_gateway.run_blocking("speech", client.recognize, config=config, audio=audio)
+        
+        # Process the response
+        transcriptions = []
+        for result in response.results:
+            for alternative in result.alternatives:
+                transcription = {
+                    "transcript": alternative.transcript,
+                    "confidence": alternative.confidence,
+                    "channel_tag": 0  # Default to 0 since we're using mono
+                }
+                transcriptions.append(transcription)
+                logger.debug(f"Added transcription: {transcription}")
+        
+        if not transcriptions:
+            logger.warning("No transcriptions found in the response.")
             
-            if not transcriptions:
-                logger.warning("No transcriptions found in the response.")
-                
-            logger.debug(f"Returning {len(transcriptions)} transcriptions")
-            return transcriptions
+        logger.debug(f"Returning {len(transcriptions)} transcriptions")
+        return transcriptions
             
     except Exception as e:
         error_msg = f"Error in transcribe_speech_from_audio: {str(e)}"
@@ -203,7 +407,88 @@ async def transcribe_speech_from_audio(
 
 
 
-def llm_learner_response(chat_history: List[Dict[str, str]]) -> str:
+def streaming_recognition_config(
+    language_code: str = "en-US",
+    encoding: str = STT_STREAM_ENCODING,
+    sample_rate_hertz: Optional[int] = STT_STREAM_SAMPLE_RATE,
+) -> speech.StreamingRecognitionConfig:
+    """
+    Build the config for a streaming recognition session.
+    
+    Raises:
+        ValueError: If the encoding name is not a RecognitionConfig.AudioEncoding
+    """
+    try:
+        audio_encoding = speech.RecognitionConfig.AudioEncoding[encoding.upper()]
+    except KeyError:
+        raise ValueError(f"Unsupported audio encoding: {encoding}")
+    config = speech.RecognitionConfig(
+        encoding=audio_encoding,
+        language_code=language_code,
+        audio_channel_count=1,
+        enable_automatic_punctuation=True,
+    )
+    if sample_rate_hertz:
+        config.sample_rate_hertz = sample_rate_hertz
+    return speech.StreamingRecognitionConfig(config=config, interim_results=True)
+
+
+async def stream_transcribe(
+    audio_chunks: AsyncIterator[bytes],
+    streaming_config: speech.StreamingRecognitionConfig,
+    api_clients: Optional[clients.Clients] = None,
+) -> AsyncIterator[Dict[str, Union[str, float, bool]]]:
+    """
+    Transcribe audio while it is still being recorded.
+    
+    Audio chunks are forwarded to Google's streaming_recognize as they
+    arrive, and a result is yielded for every interim and final hypothesis.
+    
+    Args:
+        audio_chunks: Audio in the encoding named by ``streaming_config``
+        streaming_config: See streaming_recognition_config
+        api_clients: Shared upstream clients (defaults to clients.current())
+        
+    Yields:
+        {"transcript", "is_final", "stability", "confidence"} dicts
+    """
+    async def requests():
+        yield speech.StreamingRecognizeRequest(streaming_config=streaming_config)
+        async for chunk in audio_chunks:
+            # Requests are limited in size, so split large chunks
+            for start in range(0, len(chunk), STT_STREAM_MAX_REQUEST_BYTES):
+                yield speech.StreamingRecognizeRequest(
+                    audio_content=chunk[start:start + STT_STREAM_MAX_REQUEST_BYTES]
+                )
+
+    async with llm_gateway.limit("speech_stream"):
+        client = (api_clients or clients.current()).speech_async_client
+        responses = await client.streaming_recognize(requests=requests())
+        async for response in responses:
+            for result in response.results:
+                if not result.alternatives:
+                    continue
+                alternative = result.alternatives[0]
+                yield {
+                    "transcript": alternative.transcript,
+                    "is_final": result.is_final,
+                    "stability": result.stability,
+                    "confidence": alternative.confidence,
+                }
+
+
+async def _learner_request(chat_history: List[Dict[str, str]]):
+    """Build the Gemini messages and system prompt extras for a learner turn."""
+    # Keep recent turns verbatim and older ones as a rolling summary
+    summary, recent_messages = await rolling_context(chat_history)
+    summary_parts = (f"Summary of the conversation so far:\n{summary}",) if summary else ()
+
+    # Map the standard role names to Gemini's expected roles
+    # "assistant" → "model", "user" → "user"
+    return gemini_messages(recent_messages), summary_parts
+
+
+async def llm_learner_response(chat_history: List[Dict[str, str]]) -> str:
     """
     Generate a response from the LLM based on the chat history.
     
@@ -217,72 +502,62 @@ def llm_learner_response(chat_history: List[Dict[str, str]]) -> str:
     Returns:
         A string containing the LLM's response
     """
-    # Load API key from environment
-    load_dotenv()
-    api_key = os.getenv("API_KEY")
-    if not api_key:
-        raise ValueError("GOOGLE_API_KEY environment variable is not set")
+    formatted_messages, summary_parts = await _learner_request(chat_history)
     
-    genai.configure(api_key=api_key)
-
-    # Load the system prompt from prompt.txt
     try:
-        prompt_file_path = os.path.join(os.path.dirname(__file__), "prompt.txt")
-        with open(prompt_file_path, "r") as file:
-            system_prompt = file.read()
+        # Generate response from Gemini, after the learner system prompt
+        response = await generate_with_prompt("learner", formatted_messages, LEARNER_CONFIG, summary_parts)
+        return response.text
     except Exception as e:
-        logger.error(f"Error reading prompt file: {str(e)}")
-        raise Exception(f"Failed to read prompt file: {str(e)}")
+        logger.error(f"Error generating LLM response: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise Exception(f"Failed to generate LLM response: {str(e)}")
 
 
-    # Convert to the format Gemini expects
-    formatted_messages = []
+async def stream_learner_response(chat_history: List[Dict[str, str]]) -> AsyncIterator[str]:
+    """
+    Streaming version of llm_learner_response: yields the reply as Gemini generates it.
     
-    # Add system prompt as a user message (Gemini doesn't have a system role)
-    formatted_messages.append({
-        "role": "user",
-        "parts": [{"text": system_prompt}]
-    })
-
+    Args:
+        chat_history: A list of {"role", "content"} message dictionaries
+        
+    Yields:
+        Text fragments of the LLM's response
+    """
+    formatted_messages, summary_parts = await _learner_request(chat_history)
     
+    try:
+        async with contextlib.aclosing(
+            stream_with_prompt("learner", formatted_messages, LEARNER_CONFIG, summary_parts)
+        ) as fragments:
+            async for fragment in fragments:
+                yield fragment
+    except Exception as e:
+        logger.error(f"Error streaming LLM response: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise Exception(f"Failed to generate LLM response: {str(e)}")
+
+
+def gemini_messages(chat_history: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+    """
+    Convert {"role", "content"} messages to Gemini's format.
     
-    # Map the standard role names to Gemini's expected roles
-    # "assistant" → "model", "user" → "user"
+    System messages are skipped: the registered system prompt replaces them.
+    """
+    formatted_messages = []
     for message in chat_history:
         role = message.get("role", "")
         content = message.get("content", "")
         
-        # Skip system messages as we've already added the primary system prompt
         if role == "system":
             continue
             
-        # Convert to the format Gemini expects
         gemini_role = "model" if role == "assistant" else "user"
         formatted_messages.append({
             "role": gemini_role,
             "parts": [{"text": content}]
         })
-    
-    # Define the model and generation config
-    model = genai.GenerativeModel(
-        'gemini-2.0-flash',  
-        generation_config={
-            "temperature": 0.7,  # Slightly higher temperature for more conversational responses
-            "top_p": 0.85,
-            "top_k": 40,
-            "max_output_tokens": 800,
-        },
-    )
-    
-    try:
-        # Generate response from Gemini
-        # logger.debug(f"Sending formatted messages to Gemini: {formatted_messages}")
-        response = model.generate_content(formatted_messages)
-        return response.text
-    except Exception as e:
-        logger.error(f"Error generating LLM response: {str(e)}")
-        logger.error(traceback.format_exc())
-        raise Exception(f"Failed to generate LLM response: {str(e)}")
+    return formatted_messages
 
 
 class Evaluation(typing.TypedDict):
@@ -292,88 +567,140 @@ class Evaluation(typing.TypedDict):
     overall_score: int
 
 
-def evaluate(chat_history_json: str) -> Dict[str, int]:
+EVALUATION_KEYS = list(Evaluation.__annotations__)
+
+EVALUATION_CONFIG = json_config({
+    "temperature": 0.7, 
+}, Evaluation)
+
+
+def parse_evaluation(text: str) -> Dict[str, int]:
+    """
+    Decode an evaluation response into integer scores for every metric.
+    
+    Raises:
+        ValueError: If the response holds no usable evaluation
+    """
+    result = parse_object(text)
+    scores = {}
+    for key in EVALUATION_KEYS:
+        try:
+            scores[key] = int(round(float(result.get(key, 0))))
+        except (TypeError, ValueError):
+            scores[key] = 0
+    if not any(scores.values()):
+        raise ValueError("Response contains no evaluation scores")
+    return scores
+
+
+def evaluation_key(chat_history: List[Dict[str, str]]) -> str:
+    """
+    Build the evaluation cache key for a chat history.
+    
+    System messages are dropped (the evaluator never sees them) and
+    whitespace in each message is collapsed, so re-sending the same session
+    hits the cache.
+    """
+    transcript = [
+        (message.get("role", ""), " ".join(str(message.get("content", "")).split()))
+        for message in chat_history
+        if message.get("role") != "system"
+    ]
+    return make_key(
+        "evaluation",
+        json.dumps(transcript, ensure_ascii=False),
+        registry.get("evaluation").version,
+        llm_gateway.GEMINI_MODEL,
+    )
+
+
+async def evaluate_history(chat_history: List[Dict[str, str]]) -> Dict[str, int]:
     """
     Evaluate a conversation between a user and an AI assistant using Google's Gemini API.
     
+    Scores are cached per transcript, and concurrent requests for the same
+    transcript share one Gemini call.
+    
     Args:
-        chat_history_json: A JSON string containing an array of message objects with role and content
+        chat_history: A list of {"role", "content"} message dictionaries
         
     Returns:
         A dictionary with evaluation scores
     """
-    load_dotenv()
-    api_key = os.getenv("API_KEY")
-    if not api_key:
-        raise ValueError("GOOGLE_API_KEY environment variable is not set")
-    
-    genai.configure(api_key=api_key)
-
-    model = genai.GenerativeModel(
-        'gemini-2.0-flash', 
-        generation_config={
-            "temperature": 0.7, 
-            # "response_schema": Evaluation,   
-            "response_mime_type": "application/json",
-        },
-    )
-    
-    try:
-        prompt_file_path = os.path.join(os.path.dirname(__file__), "evaluation_prompt.txt")
-        with open(prompt_file_path, "r") as file:
-            system_prompt = file.read()
-    except Exception as e:
-        logger.error(f"Error reading prompt file: {str(e)}")
-        raise Exception(f"Failed to read prompt file: {str(e)}")
+    cache_key = evaluation_key(chat_history)
+    scores = await evaluation_cache.aget(cache_key)
+    if scores is not None:
+        return scores
+    return await evaluation_flight.do(cache_key, lambda: _evaluate_uncached(chat_history, cache_key))
 
 
-    # Convert to the format Gemini expects
-    print(f"chat_history_json: {chat_history_json}")
-    formatted_messages = []
-    
-    # Add system prompt as a user message (Gemini doesn't have a system role)
-    formatted_messages.append({
-        "role": "user",
-        "parts": [{"text": system_prompt}]
-    })
-    chat_history = json.loads(chat_history_json)
-    for message in chat_history:
-        role = message.get("role", "")
-        content = message.get("content", "")
-        
-        # Skip system messages as we've already added the primary system prompt
-        if role == "system":
-            continue
-            
-        # Convert to the format Gemini expects
-        gemini_role = "model" if role == "assistant" else "user"
-        formatted_messages.append({
-            "role": gemini_role,
-            "parts": [{"text": content}]
-        })
-    
+async def _evaluate_uncached(chat_history: List[Dict[str, str]], cache_key: str) -> Dict[str, int]:
+    formatted_messages = gemini_messages(chat_history)
 
     try:
-        response = model.generate_content(formatted_messages)
-        # Parse the response text into a Python dictionary
-        try:
-            # Clean up the response text if needed
-            response_text = response.text.strip()
-            # Parse the JSON string to a Python dict
-            result = json.loads(response_text)
-            return result
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse response as JSON: {e}")
-            # Return a default structure if parsing fails
-            return {
-                "knowledge_accuracy": 0,
-                "explanation_quality": 0,
-                "intuitiveness": 0,
-                "overall_score": 0
-            }
+        response = await generate_with_prompt("evaluation", formatted_messages, EVALUATION_CONFIG)
     except Exception as e:
         logger.error(f"Error generating LLM response: {str(e)}")
         logger.error(traceback.format_exc())
         raise Exception(f"Failed to generate LLM response: {str(e)}")
+
+    # Parse the response text into a Python dictionary
+    try:
+        scores = parse_evaluation(response.text)
+    except ValueError as e:
+        logger.error(f"Failed to parse response as JSON: {e}")
+        # Return a default structure if parsing fails (and don't cache it)
+        return {key: 0 for key in EVALUATION_KEYS}
+    await evaluation_cache.aset(cache_key, scores)
+    return scores
+
+
+async def evaluate(chat_history_json: str) -> Dict[str, int]:
+    """
+    Evaluate a conversation given as a JSON string; see evaluate_history.
+    
+    Args:
+        chat_history_json: A JSON string containing an array of message objects with role and content
+        
+    Returns:
+        A dictionary with evaluation scores
+    """
+    return await evaluate_history(json.loads(chat_history_json))
+
+
+async def evaluate_batch(
+    chat_histories: List[List[Dict[str, str]]],
+    concurrency: int = EVALUATION_BATCH_CONCURRENCY,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Evaluate many conversations, yielding each result as soon as it is ready.
     
-    pass
\ No newline at end of file
+    Cached transcripts are answered immediately; the rest are sent to Gemini
+    at most ``concurrency`` at a time. A failed evaluation is reported in
+    its result instead of failing the batch.
+    
+    Yields:
+        {"index", "scores", "cached"} for a scored transcript, or
+        {"index", "error"} for one that could not be evaluated
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(index: int, chat_history: List[Dict[str, str]]) -> Dict[str, Any]:
+        scores = await evaluation_cache.aget(evaluation_key(chat_history))
+        if scores is not None:
+            return {"index": index, "scores": scores, "cached": True}
+        try:
+            async with semaphore:
+                scores = await evaluate_history(chat_history)
+        except Exception as e:
+            logger.error(f"Error evaluating batch item {index}: {str(e)}")
+            return {"index": index, "error": str(e)}
+        return {"index": index, "scores": scores, "cached": False}
+
+    tasks = [asyncio.create_task(run(index, chat_history)) for index, chat_history in enumerate(chat_histories)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,189 @@
+"""
+Server-side sessions.
+
+:class:`ServerSessionMiddleware` is a drop-in replacement for Starlette's
+cookie-based ``SessionMiddleware``: ``request.session`` works the same, but
+the session data lives in a :mod:`app.stores` backend and the cookie only
+carries a signed session ID. Request headers stay small no matter how much
+is stored in the session, and with a shared backend (SQLite) and a stable
+``SESSION_SECRET`` every worker process can serve every session.
+
+Like Starlette's middleware, a client is only given a session (and a
+cookie) once something is stored in it. Session changes are saved when the
+response body completes, so handlers that stream their response can still
+update the session; a handler that fills an empty session only while
+streaming must call :func:`reserve_session` before the response starts, so
+the cookie goes out with the headers.
+"""
+import json
+import logging
+import os
+import secrets
+from typing import Optional
+
+from itsdangerous import BadSignature, TimestampSigner
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.stores import KeyValueStore, create_store
+
+logger = logging.getLogger(__name__)
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_MAX_AGE = int(os.getenv("SESSION_MAX_AGE", str(14 * 24 * 60 * 60)))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "10000"))
+# Shorter secrets are rejected, since anyone who guesses the key can forge session IDs
+SESSION_SECRET_MIN_LENGTH = 32
+
+
+# Scope key set by reserve_session
+SESSION_RESERVED = "session_reserved"
+
+
+def reserve_session(connection: HTTPConnection):
+    """Send a session cookie with this response even if the session is still empty."""
+    connection.scope[SESSION_RESERVED] = True
+
+
+def session_secret() -> str:
+    """
+    Return the configured session secret.
+
+    Without ``SESSION_SECRET``, the default in-memory backend (development,
+    a single worker) gets a random per-process secret with a warning. A
+    shared backend needs the same secret in every worker, so startup fails
+    instead of signing IDs with a key nobody chose.
+
+    Raises:
+        RuntimeError: If the secret is too short, or missing with a shared backend
+    """
+    secret = os.getenv("SESSION_SECRET")
+    if secret:
+        if len(secret) < SESSION_SECRET_MIN_LENGTH:
+            raise RuntimeError(f"SESSION_SECRET must be at least {SESSION_SECRET_MIN_LENGTH} characters long")
+        return secret
+    if SESSION_BACKEND != "memory":
+        raise RuntimeError(f"SESSION_SECRET must be set when SESSION_BACKEND is {SESSION_BACKEND!r}")
+    logger.warning(
+        "SESSION_SECRET is not set; using a random secret. Sessions will not "
+        "survive restarts or be shared between workers."
+    )
+    return secrets.token_urlsafe(32)
+
+
+def create_session_store() -> KeyValueStore:
+    return create_store(
+        SESSION_BACKEND,
+        table="sessions",
+        ttl=SESSION_MAX_AGE,
+        max_items=SESSION_MAX_ENTRIES,
+    )
+
+
+class ServerSessionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        store: KeyValueStore,
+        secret_key: str,
+        session_cookie: str = "session",
+        max_age: Optional[int] = SESSION_MAX_AGE,
+        path: str = "/",
+        same_site: str = "lax",
+        https_only: bool = False,
+    ):
+        self.app = app
+        self.store = store
+        self.signer = TimestampSigner(secret_key)
+        self.session_cookie = session_cookie
+        self.max_age = max_age
+        self.path = path
+        self.security_flags = f"httponly; samesite={same_site}"
+        if https_only:
+            self.security_flags += "; secure"
+
+    async def _call_store(self, method, *args):
+        if self.store.blocking:
+            return await run_in_threadpool(method, *args)
+        return method(*args)
+
+    def _session_id_from_cookie(self, connection: HTTPConnection) -> Optional[str]:
+        cookie = connection.cookies.get(self.session_cookie)
+        if not cookie:
+            return None
+        try:
+            return self.signer.unsign(cookie, max_age=self.max_age).decode("utf-8")
+        except BadSignature:
+            return None
+
+    def _cookie_header(self, session_id: str) -> str:
+        value = self.signer.sign(session_id).decode("utf-8")
+        header = f"{self.session_cookie}={value}; path={self.path}; "
+        if self.max_age:
+            header += f"Max-Age={self.max_age}; "
+        return header + self.security_flags
+
+    def _clear_cookie_header(self) -> str:
+        return (
+            f"{self.session_cookie}=null; path={self.path}; "
+            f"expires=Thu, 01 Jan 1970 00:00:00 GMT; {self.security_flags}"
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        connection = HTTPConnection(scope)
+        session_id = self._session_id_from_cookie(connection)
+        data = None
+        if session_id is not None:
+            data = await self._call_store(self.store.get, session_id)
+        is_new = data is None
+        if is_new:
+            # Unknown, expired or missing session: start a fresh one, which
+            # only gets an ID once there is something to store
+            session_id = None
+            data = {}
+
+        scope["session"] = data
+        initial = json.dumps(data, sort_keys=True)
+        saved = False
+
+        async def save():
+            nonlocal saved
+            if saved:
+                return
+            saved = True
+            if json.dumps(scope["session"], sort_keys=True) == initial:
+                return
+            if scope["session"]:
+                if session_id is None:
+                    logger.warning("Session data was added after the response started without reserve_session; dropping it")
+                    return
+                await self._call_store(self.store.set, session_id, scope["session"])
+            elif not is_new:
+                await self._call_store(self.store.delete, session_id)
+
+        async def send_wrapper(message: Message):
+            nonlocal session_id
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                if is_new and (scope["session"] or scope.get(SESSION_RESERVED)):
+                    # Hand out the ID up front so data saved while the body
+                    # streams can be found on the next request
+                    session_id = secrets.token_urlsafe(24)
+                    headers.append("Set-Cookie", self._cookie_header(session_id))
+                elif not is_new and not scope["session"]:
+                    headers.append("Set-Cookie", self._clear_cookie_header())
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                await save()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Websockets and aborted responses never send a final body message
+            await save()
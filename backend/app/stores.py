@@ -0,0 +1,163 @@
+"""
+Key-value stores for server-side state (sessions, decks, ...).
+
+Two interchangeable implementations are provided:
+
+- :class:`MemoryStore` keeps values in a per-process LRU with a TTL. It is
+  fast but not shared between workers.
+- :class:`SQLiteStore` keeps JSON values in a SQLite table, so every worker
+  process on a host sees the same state and it survives restarts.
+
+Use :func:`create_store` to pick one from configuration.
+"""
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from app.cache import CACHE_DIR, LRUCache
+
+STORE_BACKENDS = ("memory", "sqlite")
+
+# Default SQLite database shared by all sqlite-backed stores
+STORE_SQLITE_PATH = os.getenv("STORE_SQLITE_PATH", os.path.join(CACHE_DIR, "state.sqlite3"))
+
+
+class KeyValueStore:
+    """Interface for server-side stores. Values must be JSON-serializable."""
+
+    # Whether calls do I/O and should be run off the event loop
+    blocking = False
+
+    def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+    def close(self):
+        pass
+
+
+class MemoryStore(KeyValueStore):
+    """
+    Per-process LRU store with a TTL.
+
+    Values are copied in and out, so callers mutating what they got (or
+    stored) don't change the store behind its back, as with SQLiteStore.
+    """
+
+    def __init__(self, max_items: int = 10000, ttl: Optional[float] = None):
+        self._cache = LRUCache(max_items, ttl=ttl)
+
+    def get(self, key: str) -> Optional[Any]:
+        return copy.deepcopy(self._cache.get(key))
+
+    def set(self, key: str, value: Any):
+        self._cache.set(key, copy.deepcopy(value))
+
+    def delete(self, key: str):
+        self._cache.delete(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", **self._cache.stats()}
+
+
+class SQLiteStore(KeyValueStore):
+    """SQLite-backed store shared by all worker processes on a host."""
+
+    blocking = True
+
+    # Expired rows are purged every this many writes
+    PURGE_EVERY = 200
+
+    def __init__(self, path: str, table: str, ttl: Optional[float] = None):
+        if not table.isidentifier():
+            raise ValueError(f"Invalid table name {table!r}")
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            self.delete(key)
+            return None
+        return json.loads(value)
+
+    def set(self, key: str, value: Any):
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at),
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._conn.execute(
+                    f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                    (time.time(),),
+                )
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (items,) = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        return {"backend": "sqlite", "items": items}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_store(
+    backend: str,
+    table: str,
+    ttl: Optional[float] = None,
+    max_items: int = 10000,
+    path: str = STORE_SQLITE_PATH,
+) -> KeyValueStore:
+    """
+    Create a store by backend name ("memory" or "sqlite").
+
+    Args:
+        backend: Backend name
+        table: Table name used by the SQLite backend
+        ttl: Seconds after the last write before an entry expires
+        max_items: Capacity of the memory backend
+        path: Database file used by the SQLite backend
+    """
+    backend = backend.lower()
+    if backend == "memory":
+        return MemoryStore(max_items=max_items, ttl=ttl)
+    if backend == "sqlite":
+        return SQLiteStore(path, table, ttl=ttl)
+    raise ValueError(f"Unknown store backend {backend!r}, expected one of {STORE_BACKENDS}")
@@ -0,0 +1,68 @@
+"""
+Helpers for streaming incremental results to the client.
+
+Results are sent as a sequence of named events, either as Server-Sent
+Events (``format=sse``) or as newline-delimited JSON (the default), where
+each line is a JSON object with an ``event`` field.
+"""
+import json
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+STREAM_FORMATS = ("ndjson", "sse")
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+
+def resolve_format(format: Optional[str], accept: Optional[str] = None) -> str:
+    """Pick the stream format from an explicit ``format`` parameter or the Accept header."""
+    if format:
+        format = format.lower()
+        if format not in STREAM_FORMATS:
+            raise HTTPException(status_code=400, detail=f"format must be one of {STREAM_FORMATS}")
+        return format
+    if accept and "text/event-stream" in accept:
+        return "sse"
+    return "ndjson"
+
+
+def encode_event(event: str, data: Dict[str, Any], format: str) -> str:
+    """Serialize one event in the given stream format."""
+    if format == "sse":
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"event": event, **data}) + "\n"
+
+
+def event_stream_response(
+    events: AsyncIterator[Tuple[str, Dict[str, Any]]],
+    format: str,
+    headers: Optional[Dict[str, str]] = None,
+) -> StreamingResponse:
+    """
+    Wrap an async iterator of ``(event, data)`` pairs in a StreamingResponse.
+
+    Errors raised after the response has started are reported as a final
+    ``error`` event, since the status code has already been sent.
+    """
+    async def body():
+        try:
+            async for event, data in events:
+                yield encode_event(event, data, format)
+        except Exception as e:
+            yield encode_event("error", {"detail": str(e)}, format)
+
+    return StreamingResponse(
+        body(),
+        media_type=MEDIA_TYPES[format],
+        headers={
+            "Cache-Control": "no-cache",
+            # Stop reverse proxies from buffering the stream
+            "X-Accel-Buffering": "no",
+            **(headers or {}),
+        },
+    )
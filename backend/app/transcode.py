@@ -0,0 +1,108 @@
+"""
+Async audio transcoding with ffmpeg.
+
+Recordings in formats Speech-to-Text can't decode are converted to raw
+16-bit mono PCM (LINEAR16) before the recognition call, so every request
+makes exactly one recognize call. ffmpeg runs as an asyncio subprocess that
+reads the recording from stdin and writes PCM to stdout, so the event loop
+is never blocked and nothing touches the disk. The exception is MP4/M4A
+input: its index may sit at the end of the file, which ffmpeg can't seek to
+on a pipe, so if decoding from the pipe fails it is retried from a
+temporary file.
+
+At most ``FFMPEG_CONCURRENCY`` conversions run at once per worker.
+"""
+import asyncio
+import os
+import tempfile
+from typing import Optional
+
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+FFMPEG_CONCURRENCY = int(os.getenv("FFMPEG_CONCURRENCY", str(os.cpu_count() or 2)))
+FFMPEG_TIMEOUT = float(os.getenv("FFMPEG_TIMEOUT", "60"))
+
+# Output format of to_linear16
+TRANSCODE_SAMPLE_RATE = 16000
+
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+class TranscodeError(Exception):
+    """Raised when ffmpeg is missing or can't convert the audio."""
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(max(1, FFMPEG_CONCURRENCY))
+    return _semaphore
+
+
+def is_mp4(audio: bytes) -> bool:
+    return audio[4:8] == b"ftyp"
+
+
+async def _run_ffmpeg(input_path: str, audio: Optional[bytes], sample_rate: int) -> bytes:
+    cmd = [
+        FFMPEG_BINARY, "-hide_banner", "-loglevel", "error",
+        "-i", input_path,
+        "-f", "s16le", "-acodec", "pcm_s16le", "-ar", str(sample_rate), "-ac", "1",
+        "pipe:1",
+    ]
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE if audio is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        raise TranscodeError(f"{FFMPEG_BINARY} is not installed")
+
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(audio), FFMPEG_TIMEOUT)
+    except BaseException:
+        # Timed out or cancelled: don't leave ffmpeg running
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+
+    if process.returncode != 0 or not stdout:
+        raise TranscodeError(f"Audio conversion failed: {stderr.decode('utf-8', errors='replace').strip()}")
+    return stdout
+
+
+async def to_linear16(audio: bytes, sample_rate: int = TRANSCODE_SAMPLE_RATE) -> bytes:
+    """
+    Convert audio in any format ffmpeg can read to raw LINEAR16 PCM.
+
+    Args:
+        audio: The encoded recording
+        sample_rate: Sample rate of the output
+
+    Returns:
+        Mono 16-bit little-endian PCM samples, without a header
+
+    Raises:
+        TranscodeError: If ffmpeg is missing, fails or times out
+    """
+    async with _get_semaphore():
+        try:
+            return await _run_ffmpeg("pipe:0", audio, sample_rate)
+        except asyncio.TimeoutError:
+            raise TranscodeError("Audio conversion timed out")
+        except TranscodeError:
+            if not is_mp4(audio):
+                raise
+
+        # MP4 with its index at the end needs a seekable input
+        fd, path = tempfile.mkstemp(suffix=".m4a")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(audio)
+            return await _run_ffmpeg(path, None, sample_rate)
+        except asyncio.TimeoutError:
+            raise TranscodeError("Audio conversion timed out")
+        finally:
+            os.unlink(path)
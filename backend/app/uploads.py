@@ -0,0 +1,142 @@
+"""
+Shared handling for uploaded files.
+
+Upload size limits are enforced by :class:`UploadLimitMiddleware` before the
+multipart body is parsed: requests that declare a larger ``Content-Length``
+are rejected without reading the body, and bodies that turn out larger are
+cut off as they stream in. Starlette has already spooled an accepted upload
+(in memory, rolling over to a temp file), so :class:`SpooledUpload` works
+on that spool directly instead of copying it again.
+"""
+import hashlib
+import os
+from typing import BinaryIO, Dict, Optional
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Maximum accepted upload sizes
+MAX_PDF_UPLOAD_BYTES = int(os.getenv("MAX_PDF_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+MAX_AUDIO_UPLOAD_BYTES = int(os.getenv("MAX_AUDIO_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+
+# Allowance for the other form fields and multipart framing around a file
+UPLOAD_FORM_OVERHEAD_BYTES = int(os.getenv("UPLOAD_FORM_OVERHEAD_BYTES", str(1024 * 1024)))
+
+
+def _too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Upload exceeds the maximum size of {max_bytes} bytes",
+    )
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware capping the size of multipart request bodies per path prefix.
+
+    Usage:
+        app.add_middleware(UploadLimitMiddleware, limits={"/api/gemini": MAX_PDF_UPLOAD_BYTES})
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        # Longest prefix first so nested prefixes can have their own limit
+        self.limits = sorted(limits.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def _limit(self, scope) -> Optional[int]:
+        headers = Headers(scope=scope)
+        if not headers.get("content-type", "").startswith("multipart/form-data"):
+            return None
+        for prefix, max_bytes in self.limits:
+            if scope["path"].startswith(prefix):
+                return max_bytes
+        return None
+
+    async def __call__(self, scope, receive, send):
+        max_bytes = self._limit(scope) if scope["type"] == "http" else None
+        if max_bytes is None:
+            await self.app(scope, receive, send)
+            return
+
+        body_limit = max_bytes + UPLOAD_FORM_OVERHEAD_BYTES
+        content_length = Headers(scope=scope).get("content-length", "")
+        if content_length.isdigit() and int(content_length) > body_limit:
+            error = _too_large(max_bytes)
+            response = JSONResponse({"detail": error.detail}, status_code=error.status_code)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > body_limit:
+                    # Raised inside form parsing, which FastAPI re-raises as is
+                    raise _too_large(max_bytes)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+class SpooledUpload:
+    """
+    Async context manager over an ``UploadFile`` already spooled by Starlette.
+
+    Checks the upload's size against a limit (UploadLimitMiddleware has
+    already bounded the request body) and, with ``hash_content``, computes
+    its SHA-256 in one pass over the spool.
+
+    Usage:
+        async with SpooledUpload(file, MAX_PDF_UPLOAD_BYTES, hash_content=True) as upload:
+            text = parse(upload.file)
+    """
+
+    def __init__(self, upload: UploadFile, max_bytes: int, hash_content: bool = False):
+        self.upload = upload
+        self.max_bytes = max_bytes
+        self.hash_content = hash_content
+        self.size = 0
+        self._digest = hashlib.sha256()
+
+    async def __aenter__(self) -> "SpooledUpload":
+        await self.upload.seek(0)
+        if not self.hash_content and self.upload.size is not None:
+            self.size = self.upload.size
+        else:
+            while True:
+                chunk = await self.upload.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.size += len(chunk)
+                if self.size > self.max_bytes:
+                    break
+                self._digest.update(chunk)
+            await self.upload.seek(0)
+        if self.size > self.max_bytes:
+            raise _too_large(self.max_bytes)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.upload.close()
+
+    @property
+    def sha256(self) -> str:
+        """Hex SHA-256 digest of the upload (requires ``hash_content``)."""
+        return self._digest.hexdigest()
+
+    @property
+    def file(self) -> BinaryIO:
+        """Starlette's spool of the upload, positioned at the start."""
+        self.upload.file.seek(0)
+        return self.upload.file
+
+    async def read_bytes(self) -> bytes:
+        """The upload as ``bytes``, for APIs that require them."""
+        await self.upload.seek(0)
+        return await self.upload.read()
@@ -1,42 +1,242 @@
-import google.generativeai as genai
-import PyPDF2
 import typing_extensions as typing
-import os
-from dotenv import load_dotenv
+import asyncio
+import contextlib
+import itertools
 import json
+import math
+import os
+import re
+from app import llm_gateway, pdf_text
+from app.decoding import format_card, json_config, parse_array, parse_cards
+from app.json_stream import JSONArrayStreamParser
+
+# Bump whenever a card prompt changes so cached decks are regenerated
+CARD_PROMPT_VERSION = "4"
+
+# Number of flashcards in a generated deck
+DECK_SIZE = 10
+
+# Documents longer than CARD_CHUNK_TOKENS (estimated at CHARS_PER_TOKEN
+# characters per token) are split into chunks that are generated concurrently
+CARD_CHUNK_TOKENS = int(os.getenv("CARD_CHUNK_TOKENS", "8000"))
+CHARS_PER_TOKEN = 4
+CARD_CHUNK_OVERSAMPLE = 2
+CARD_CHUNK_RETRIES = int(os.getenv("CARD_CHUNK_RETRIES", "1"))
+
+# Follow-up requests made to fill a short deck before giving up
+CARD_TOPUP_RETRIES = int(os.getenv("CARD_TOPUP_RETRIES", "2"))
 
 class Card(typing.TypedDict):
     question: str
     answer: str
 
-load_dotenv()
-api_key = os.getenv("API_KEY")
-genai.configure(api_key=api_key)
-
-def parsePDF_to_text(file_name):
-    #take an input pdf, convert to text
-    text = ""
-    with open(file_name, "rb") as file:
-        reader = PyPDF2.PdfReader(file)
-        for page in reader.pages:
-            text += page.extract_text() or ''
-    return text
-
-def generate_cards(text):
-
-    # Define the model and prompt
-    model = genai.GenerativeModel(
-        'gemini-2.0-flash',  
-        generation_config={
-            "temperature": 0.1,
-            "top_p": 0.8,
-            "top_k": 40,
-        }
+# Generation settings for each kind of card request, constrained to a JSON array of Cards
+TEXT_CARD_CONFIG = json_config({
+    "temperature": 0.1,
+    "top_p": 0.8,
+    "top_k": 40,
+}, list[Card])
+SUBJECT_CARD_CONFIG = json_config({
+    "temperature": 0.7,  # Slightly higher temperature for more creative responses
+    "top_p": 0.8,
+    "top_k": 40,
+}, list[Card])
+EDIT_CARD_CONFIG = json_config({
+    "temperature": 0.3,  # Lower temperature for more consistent edits
+    "top_p": 0.8,
+    "top_k": 40,
+}, list[Card])
+
+class CardEdit(typing.TypedDict):
+    op: str
+    card: int
+    question: str
+    answer: str
+
+CARD_EDIT_CONFIG = json_config({
+    "temperature": 0.3,
+    "top_p": 0.8,
+    "top_k": 40,
+}, list[CardEdit])
+
+# Words that say nothing about which cards an edit instruction is about
+EDIT_STOPWORDS = frozenset("""
+    a an and any are as at be but by can card cards change could do does for from
+    have how i in into is it its make me more my of on one ones or please question
+    questions answer answers rewrite shorter longer should so that the them these
+    they this those to up update use want was what when which who why will with
+    would you your flashcard flashcards fix edit remove delete add replace
+""".split())
+
+# Instructions that apply to the whole deck
+EDIT_WHOLE_DECK = re.compile(r"\b(all|every|each|entire|whole|deck|everything|overall)\b", re.IGNORECASE)
+
+# "card 3", "cards 2 and 5", "questions 1-4", "#7"
+EDIT_CARD_NUMBERS = re.compile(
+    r"(?:\b(?:cards?|flashcards?|questions?|answers?|number|no\.)\s*#?|#)"
+    r"(\d+(?:\s*(?:,|and|&|-|to|through)\s*\d+)*)",
+    re.IGNORECASE,
+)
+EDIT_ORDINALS = {
+    "first": 1, "second": 2, "third": 3, "fourth": 4, "fifth": 5,
+    "sixth": 6, "seventh": 7, "eighth": 8, "ninth": 9, "tenth": 10,
+}
+EDIT_ORDINAL_CARD = re.compile(
+    r"\b(" + "|".join(EDIT_ORDINALS) + r"|last)\s+(?:card|flashcard|question|answer|one)\b",
+    re.IGNORECASE,
+)
+
+def parsePDF_to_text(file_name, backend=None):
+    #take an input pdf (path or open file), convert to text
+    return pdf_text.extract_text(file_name, backend)
+
+async def parsePDF_to_text_async(file_name, backend=None):
+    #same as parsePDF_to_text, but off the event loop and parallel across pages for big PDFs
+    return await pdf_text.extract_text_async(file_name, backend)
+
+async def generate_cards(text, num_cards=DECK_SIZE, api_clients=None):
+    """
+    Generate flashcards from document text.
+    
+    Texts that fit in one chunk are sent in a single prompt. Longer texts are
+    split by token budget, candidate cards are generated for every chunk
+    concurrently, and the candidates are merged and deduplicated into a deck
+    of ``num_cards`` cards.
+    
+    Args:
+        text (str): The document text
+        num_cards (int): The number of flashcards in the deck
+        api_clients (Clients): Shared upstream clients (defaults to clients.current())
+        
+    Returns:
+        list: A list of flashcards with question and answer pairs
+    """
+    chunks = split_text_by_tokens(text)
+    if len(chunks) <= 1:
+        cards = await _cards_from_text(text, num_cards, api_clients=api_clients)
+        return await complete_deck(
+            cards,
+            num_cards,
+            lambda missing, existing: _cards_from_text(text, missing, existing, api_clients),
+        )
+
+    per_chunk = _candidates_per_chunk(num_cards, len(chunks))
+    print(f"Generating flashcards from {len(chunks)} chunks, {per_chunk} candidates each")
+
+    candidates = await asyncio.gather(*[_cards_from_chunk(chunk, per_chunk, api_clients) for chunk in chunks])
+
+    # Top up from the chunks in turn if deduplication left the deck short
+    next_chunk = itertools.cycle(chunks)
+    return await complete_deck(
+        merge_cards(candidates, num_cards),
+        num_cards,
+        lambda missing, existing: _cards_from_text(next(next_chunk), missing, existing, api_clients),
     )
+
+
+def _candidates_per_chunk(num_cards, num_chunks):
+    # Ask each chunk for more than its share so deduplication still leaves enough
+    return min(num_cards, max(2, math.ceil(num_cards * CARD_CHUNK_OVERSAMPLE / num_chunks)))
+
+
+async def _cards_from_chunk(chunk, num_cards, api_clients=None):
+    # A failed chunk is retried on its own instead of redoing the whole document
+    for _ in range(1 + CARD_CHUNK_RETRIES):
+        cards = await _cards_from_text(chunk, num_cards, api_clients=api_clients)
+        if cards:
+            return cards
+    return []
+
+
+def split_text_by_tokens(text, max_tokens=CARD_CHUNK_TOKENS):
+    """
+    Split text into chunks of at most ``max_tokens`` (estimated), on paragraph
+    or line boundaries where possible.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return [text]
+
+    chunks = []
+    current = []
+    current_len = 0
+    for line in text.splitlines(keepends=True):
+        # Hard-split lines that are longer than a whole chunk
+        pieces = [line[i:i + max_chars] for i in range(0, len(line), max_chars)] or [line]
+        for piece in pieces:
+            if current_len + len(piece) > max_chars and current:
+                chunks.append("".join(current))
+                current = []
+                current_len = 0
+            current.append(piece)
+            current_len += len(piece)
+    if current:
+        chunks.append("".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+def _question_key(question):
+    return " ".join(re.sub(r"[^\w\s]", " ", question.casefold()).split())
+
+
+def merge_cards(card_lists, num_cards):
+    """
+    Merge per-chunk candidate cards into one deck.
     
-    prompt = f"""
-    You are a JSON generator. Your task is to create exactly 10 flashcards from the given text.
-    You must respond with ONLY a JSON array containing exactly 10 objects.
+    Cards are taken round-robin across chunks so the deck covers the whole
+    document, and cards with the same (normalized) question are dropped.
+    """
+    merged = []
+    seen = set()
+    for round_cards in itertools.zip_longest(*card_lists):
+        for card in round_cards:
+            if card is None:
+                continue
+            key = _question_key(card["question"])
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(card)
+            if len(merged) == num_cards:
+                return merged
+    return merged
+
+
+async def complete_deck(cards, num_cards, generate_more):
+    """
+    Turn a possibly short or oversized batch into a deck of ``num_cards``.
+    
+    Valid cards are kept and extras are trimmed. When cards are missing,
+    ``generate_more(missing, existing_questions)`` is asked for only the
+    missing count, up to CARD_TOPUP_RETRIES times. If the deck is still
+    short after that, the cards collected so far are returned.
+    """
+    deck = merge_cards([cards], num_cards)
+    for _ in range(CARD_TOPUP_RETRIES):
+        missing = num_cards - len(deck)
+        if missing <= 0:
+            break
+        print(f"Deck has {len(deck)} of {num_cards} cards, requesting {missing} more")
+        extra = await generate_more(missing, [card["question"] for card in deck])
+        deck = merge_cards([deck + extra], num_cards)
+    return deck
+
+
+def _exclusion_note(existing_questions):
+    """Prompt fragment listing questions a follow-up request must not repeat."""
+    if not existing_questions:
+        return ""
+    listed = "\n".join(f"    - {question}" for question in existing_questions)
+    return f"""
+    These questions already exist. Do not repeat or rephrase them:
+{listed}
+    """
+
+
+def _text_card_prompt(text, num_cards, existing_questions=None):
+    return f"""
+    You are a JSON generator. Your task is to create exactly {num_cards} flashcards from the given text.
+    You must respond with ONLY a JSON array containing exactly {num_cards} objects.
     
     Each object in the array must have exactly these two fields:
     - "question": A clear, concise question about the text
@@ -52,85 +252,69 @@ def generate_cards(text):
     1. Respond with ONLY the JSON array - no other text, no explanations
     2. The response must start with [ and end with ]
     3. Use double quotes for all strings
-    4. Include exactly 10 flashcards
+    4. Include exactly {num_cards} flashcards
     5. Each flashcard must be unique
-    
+    {_exclusion_note(existing_questions)}
     Text to process:
     {text}
     """
 
+
+async def _cards_from_text(text, num_cards, existing_questions=None, api_clients=None):
+    """
+    Generate up to ``num_cards`` flashcards from a single prompt's worth of text.
+    
+    Returns every valid card in the response, even when the model produced
+    the wrong number of them; callers decide how to top up or trim.
+    """
+    cards = await _request_cards(_text_card_prompt(text, num_cards, existing_questions), TEXT_CARD_CONFIG, api_clients)
+    if cards and len(cards) != num_cards:
+        print(f"Expected {num_cards} cards, got {len(cards)}")
+    return cards or []
+
+
+async def _request_cards(prompt, generation_config, api_clients=None):
+    """
+    Run a card prompt and decode the response with the shared card parser.
+    
+    Returns the valid cards (possibly fewer than requested), or None if the
+    request failed or the response held no JSON at all.
+    """
+    response_text = ""
     try:
-        # Generate the flashcards
-        response = model.generate_content(prompt)
-        response_text = response.text.strip()
-        
-        response_text = response_text.replace('```json', '').replace('```', '').strip()
-        
-        # Ensure the response starts with [ and ends with ]
-        if not response_text.startswith('['):
-            response_text = '[' + response_text
-        if not response_text.endswith(']'):
-            response_text = response_text + ']'
-            
-        # Convert the response text to JSON
-        flashcards = json.loads(response_text)
-        
-        if not isinstance(flashcards, list):
-            raise ValueError("Response is not a JSON array")
-            
-        # Format and validate the flashcards
-        formatted_flashcards = []
-        for card in flashcards:
-            if not isinstance(card, dict):
-                continue
-            question = card.get("question", "").strip()
-            answer = card.get("answer", "").strip()
-            if question and answer:
-                formatted_flashcards.append({
-                    "question": question,
-                    "answer": answer
-                })
-        
-        # Ensure we have exactly 10 cards
-        if len(formatted_flashcards) != 10:
-            raise ValueError(f"Expected 10 cards, got {len(formatted_flashcards)}")
-            
-        return formatted_flashcards
-        
-    except json.JSONDecodeError as e:
-        print(f"Failed to parse JSON response: {e}")
-        print(f"Raw response: {response_text}")
-        return []
+        response = await llm_gateway.generate_content(prompt, generation_config, api_clients=api_clients)
+        response_text = response.text
+        return parse_cards(response_text)
     except Exception as e:
         print(f"Error generating flashcards: {e}")
         print(f"Raw response: {response_text}")
-        return []
+        return None
 
 
-def topic_selection(subject):
+async def topic_selection(subject, num_cards=DECK_SIZE, api_clients=None):
     """
     Generate flashcards based on a user-provided subject.
     
     Args:
         subject (str): The subject or topic to generate flashcards for (e.g., "Arithmetic")
+        num_cards (int): The number of flashcards in the deck
+        api_clients (Clients): Shared upstream clients (defaults to clients.current())
         
     Returns:
         list: A list of flashcards with question and answer pairs
     """
-
-    # Define the model and prompt
-    model = genai.GenerativeModel(
-        'gemini-2.0-flash',  
-        generation_config={
-            "temperature": 0.7,  # Slightly higher temperature for more creative responses
-            "top_p": 0.8,
-            "top_k": 40,
-        }
+    cards = await _cards_from_subject(subject, num_cards, api_clients=api_clients)
+    return await complete_deck(
+        cards,
+        num_cards,
+        lambda missing, existing: _cards_from_subject(subject, missing, existing, api_clients),
     )
-    
-    prompt = f"""
-    You are a JSON generator. Your task is to create exactly 10 flashcards about the subject: {subject}.
-    You must respond with ONLY a JSON array containing exactly 10 objects.
+
+
+def _subject_card_prompt(subject, num_cards, existing_questions=None):
+    return f"""
+    You are a JSON generator. Your task is to create exactly {num_cards} flashcards about the subject: {subject}.
+    You must respond with ONLY a JSON array containing exactly {num_cards} objects.
     
     Each object in the array must have exactly these two fields:
     - "question": A clear, concise question about the subject
@@ -146,87 +330,33 @@ def topic_selection(subject):
     1. Respond with ONLY the JSON array - no other text, no explanations
     2. The response must start with [ and end with ]
     3. Use double quotes for all strings
-    4. Include exactly 10 flashcards
+    4. Include exactly {num_cards} flashcards
     5. Each flashcard must be unique
     6. Focus on the main concepts of {subject}
     7. Make questions and answers educational and informative
-    """
+    {_exclusion_note(existing_questions)}"""
 
-    try:
-        # Generate the flashcards
-        response = model.generate_content(prompt)
-        response_text = response.text.strip()
-        
-        
-        # Clean the response text
-        response_text = response_text.replace('```json', '').replace('```', '').strip()
-        
-        # Ensure the response starts with [ and ends with ]
-        if not response_text.startswith('['):
-            response_text = '[' + response_text
-        if not response_text.endswith(']'):
-            response_text = response_text + ']'
-            
-        # Convert the response text to JSON
-        flashcards = json.loads(response_text)
-        
-        if not isinstance(flashcards, list):
-            raise ValueError("Response is not a JSON array")
-            
-        # Format and validate the flashcards
-        formatted_flashcards = []
-        for card in flashcards:
-            if not isinstance(card, dict):
-                continue
-            question = card.get("question", "").strip()
-            answer = card.get("answer", "").strip()
-            if question and answer:
-                formatted_flashcards.append({
-                    "question": question,
-                    "answer": answer
-                })
-        
-        # Ensure we have exactly 10 cards
-        if len(formatted_flashcards) != 10:
-            raise ValueError(f"Expected 10 cards, got {len(formatted_flashcards)}")
-            
-        return formatted_flashcards
-        
-    except json.JSONDecodeError as e:
-        print(f"Failed to parse JSON response: {e}")
-        print(f"Raw response: {response_text}")
-        return []
-    except Exception as e:
-        print(f"Error generating flashcards: {e}")
-        print(f"Raw response: {response_text}")
-        return []
 
-def edit_flashcards(flashcards, user_input):
+async def _cards_from_subject(subject, num_cards, existing_questions=None, api_clients=None):
     """
-    Edit existing flashcards based on user input using the Gemini API.
-    
-    Args:
-        flashcards (list): The original list of flashcards
-        user_input (str): User instructions for modifying the flashcards
-        
-    Returns:
-        list: The updated list of flashcards
+    Generate up to ``num_cards`` flashcards about a subject, returning every
+    valid card in the response.
     """
+    cards = await _request_cards(_subject_card_prompt(subject, num_cards, existing_questions), SUBJECT_CARD_CONFIG, api_clients)
+    if cards and len(cards) != num_cards:
+        print(f"Expected {num_cards} cards, got {len(cards)}")
+    return cards or []
 
-    # Define the model and prompt
-    model = genai.GenerativeModel(
-        'gemini-2.0-flash',  
-        generation_config={
-            "temperature": 0.3,  # Lower temperature for more consistent edits
-            "top_p": 0.8,
-            "top_k": 40,
-        }
-    )
-    
-    # Convert flashcards to a string representation
-    flashcards_str = json.dumps(flashcards, indent=2)
+
+def _compact_json(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _edit_prompt(flashcards, user_input):
+    # Convert flashcards to a compact string representation
+    flashcards_str = _compact_json([format_card(card) or card for card in flashcards])
     
-    prompt = f"""
+    return f"""
     You are a JSON editor. Your task is to modify the following flashcards based on the user's instructions.
     You must respond with ONLY a JSON array containing the modified flashcards.
     
@@ -248,49 +378,322 @@ def edit_flashcards(flashcards, user_input):
     9. If the user wants to modify specific flashcards, modify them according to the instructions
     """
 
-    try:
-        # Generate the modified flashcards
-        response = model.generate_content(prompt)
-        response_text = response.text.strip()
-        
-        # Debug: Print the raw response
-        
-        # Clean the response text
-        response_text = response_text.replace('```json', '').replace('```', '').strip()
-        
-        # Ensure the response starts with [ and ends with ]
-        if not response_text.startswith('['):
-            response_text = '[' + response_text
-        if not response_text.endswith(']'):
-            response_text = response_text + ']'
-            
-        # Convert the response text to JSON
-        modified_flashcards = json.loads(response_text)
+
+async def edit_flashcards(flashcards, user_input, api_clients=None):
+    """
+    Edit existing flashcards based on user input using the Gemini API.
+    
+    Args:
+        flashcards (list): The original list of flashcards
+        user_input (str): User instructions for modifying the flashcards
+        api_clients (Clients): Shared upstream clients (defaults to clients.current())
         
-        if not isinstance(modified_flashcards, list):
-            raise ValueError("Response is not a JSON array")
-            
-        # Format and validate the flashcards
-        formatted_flashcards = []
-        for card in modified_flashcards:
-            if not isinstance(card, dict):
+    Returns:
+        list: The updated list of flashcards
+    """
+
+    modified_flashcards = await _request_cards(_edit_prompt(flashcards, user_input), EDIT_CARD_CONFIG, api_clients)
+    if modified_flashcards is None:
+        return flashcards  # Return original flashcards if the edit failed
+    return modified_flashcards
+
+
+def _words(text):
+    return {word for word in re.findall(r"\w+", text.casefold()) if len(word) > 2 and word not in EDIT_STOPWORDS}
+
+
+def _mentioned_positions(user_input, num_cards):
+    """1-based card positions referenced by number or ordinal in an instruction."""
+    positions = set()
+    for match in EDIT_CARD_NUMBERS.finditer(user_input):
+        for start, end in re.findall(r"(\d+)(?:\s*(?:-|to|through)\s*(\d+))?", match.group(1)):
+            first = int(start)
+            last = int(end) if end else first
+            positions.update(range(first, min(last, num_cards) + 1))
+    for match in EDIT_ORDINAL_CARD.finditer(user_input):
+        word = match.group(1).casefold()
+        positions.add(num_cards if word == "last" else EDIT_ORDINALS[word])
+    return {position for position in positions if 1 <= position <= num_cards}
+
+
+def select_cards_for_edit(flashcards, user_input):
+    """
+    Pick the cards an edit instruction is about.
+    
+    Cards referenced by number ("card 3", "the last question") are picked
+    first; otherwise cards sharing keywords with the instruction are. When the
+    instruction targets the whole deck, or nothing specific can be found, every
+    card is returned so the model sees the full context.
+    
+    Returns:
+        list: 1-based positions of the selected cards
+    """
+    every_card = list(range(1, len(flashcards) + 1))
+    if EDIT_WHOLE_DECK.search(user_input):
+        return every_card
+
+    positions = _mentioned_positions(user_input, len(flashcards))
+    if not positions:
+        keywords = _words(user_input)
+        positions = {
+            position
+            for position, card in enumerate(flashcards, start=1)
+            if keywords & _words(f"{card['question']} {card['answer']}")
+        }
+
+    # Sending most of the deck anyway: keep the full context
+    if not positions or len(positions) * 2 > len(flashcards):
+        return every_card
+    return sorted(positions)
+
+
+def _delta_edit_prompt(flashcards, positions, user_input):
+    shown = _compact_json([
+        {"card": position, **format_card(flashcards[position - 1])}
+        for position in positions
+    ])
+    if len(positions) < len(flashcards):
+        scope = f"The deck has {len(flashcards)} cards; only the cards relevant to the instructions are shown."
+    else:
+        scope = f"The deck has {len(flashcards)} cards, all shown below."
+
+    return f"""
+    You edit a flashcard deck based on the user's instructions. {scope}
+    Each card has its card number in "card".
+    
+    Cards:
+    {shown}
+    
+    User instructions:
+    {user_input}
+    
+    Respond with ONLY a JSON array of edit operations, one per card that changes:
+    - Change a card: {{"op": "update", "card": <card number>, "question": "...", "answer": "..."}}
+    - Remove a card: {{"op": "delete", "card": <card number>, "question": "", "answer": ""}}
+    - Add a card: {{"op": "add", "card": 0, "question": "...", "answer": "..."}}
+    
+    IMPORTANT:
+    1. Only reference card numbers shown above
+    2. Leave cards that do not need to change out of the response
+    3. Respond with [] if nothing needs to change
+    4. Follow the user's instructions precisely
+    """
+
+
+def _edit_operations(items, flashcards, positions):
+    """Turn decoded model output into patch operations on card IDs."""
+    allowed = set(positions)
+    touched = set()
+    operations = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        op = str(item.get("op", "")).strip().lower()
+        if op == "add":
+            card = format_card(item)
+            if card is not None:
+                operations.append({"op": "add", "card": card})
+            continue
+
+        try:
+            position = int(item.get("card"))
+        except (TypeError, ValueError):
+            continue
+        if position not in allowed or position in touched:
+            continue
+        original = flashcards[position - 1]
+
+        if op == "delete":
+            touched.add(position)
+            operations.append({"op": "delete", "id": original["id"]})
+        elif op == "update":
+            card = format_card(item)
+            if card is None or card == format_card(original):
                 continue
-            question = card.get("question", "").strip()
-            answer = card.get("answer", "").strip()
-            if question and answer:
-                formatted_flashcards.append({
-                    "question": question,
-                    "answer": answer
-                })
-        
-        return formatted_flashcards
+            touched.add(position)
+            operations.append({"op": "update", "id": original["id"], "card": card})
+    return operations
+
+
+async def edit_deck(flashcards, user_input, api_clients=None):
+    """
+    Edit a stored deck and return the changes as patch operations.
+    
+    Only the cards the instruction is about (see select_cards_for_edit) are
+    sent to the model, and it replies with the cards to add, update or
+    delete rather than the whole deck.
+    
+    Args:
+        flashcards (list): The deck's cards, each with an "id"
+        user_input (str): User instructions for modifying the flashcards
+        api_clients (Clients): Shared upstream clients (defaults to clients.current())
         
-    except json.JSONDecodeError as e:
-        print(f"Failed to parse JSON response: {e}")
-        print(f"Raw response: {response_text}")
-        return flashcards  # Return original flashcards if parsing fails
+    Returns:
+        list: Patch operations (see app.decks), empty if the edit failed
+    """
+    positions = select_cards_for_edit(flashcards, user_input)
+    response_text = ""
+    try:
+        response = await llm_gateway.generate_content(
+            _delta_edit_prompt(flashcards, positions, user_input),
+            CARD_EDIT_CONFIG,
+            api_clients=api_clients,
+        )
+        response_text = response.text
+        items = parse_array(response_text)
     except Exception as e:
-        print(f"Error modifying flashcards: {e}")
+        print(f"Error editing flashcards: {e}")
         print(f"Raw response: {response_text}")
-        return flashcards  # Return original flashcards if any error occurs
+        return []
+    return _edit_operations(items, flashcards, positions)
+
+
+# Streaming variants: cards are yielded one by one as soon as each JSON
+# object in the model's streamed response is complete.
+
+class _DeckBuilder:
+    """Collects streamed cards into a deck, dropping duplicate questions."""
+
+    def __init__(self, num_cards):
+        self.num_cards = num_cards
+        self.cards = []
+        self._seen = set()
+
+    @property
+    def missing(self):
+        return self.num_cards - len(self.cards)
+
+    @property
+    def questions(self):
+        return [card["question"] for card in self.cards]
+
+    def add(self, card):
+        key = _question_key(card["question"])
+        if self.missing <= 0 or key in self._seen:
+            return False
+        self._seen.add(key)
+        self.cards.append(card)
+        return True
+
+
+async def _stream_cards(prompt, generation_config, api_clients=None):
+    """Yield valid cards from a streamed Gemini response as each object closes."""
+    parser = JSONArrayStreamParser()
+    async with contextlib.aclosing(llm_gateway.stream_content(prompt, generation_config, api_clients=api_clients)) as fragments:
+        async for fragment in fragments:
+            for item in parser.feed(fragment):
+                card = format_card(item)
+                if card is not None:
+                    yield card
+
 
+async def _stream_top_up(deck, generate_more):
+    """Yield follow-up cards until the deck is full or CARD_TOPUP_RETRIES is used up."""
+    for _ in range(CARD_TOPUP_RETRIES):
+        if deck.missing <= 0:
+            return
+        print(f"Deck has {len(deck.cards)} of {deck.num_cards} cards, requesting {deck.missing} more")
+        for card in await generate_more(deck.missing, deck.questions):
+            if deck.add(card):
+                yield card
+
+
+async def _stream_deck(prompt, generation_config, num_cards, generate_more, api_clients=None):
+    deck = _DeckBuilder(num_cards)
+    try:
+        async with contextlib.aclosing(_stream_cards(prompt, generation_config, api_clients)) as cards:
+            async for card in cards:
+                if deck.add(card):
+                    yield card
+                if deck.missing <= 0:
+                    break
+    except Exception as e:
+        # Keep the cards streamed so far and let the top-up fill the rest
+        print(f"Error streaming flashcards: {e}")
+
+    async for card in _stream_top_up(deck, generate_more):
+        yield card
+
+
+async def stream_generate_cards(text, num_cards=DECK_SIZE, api_clients=None):
+    """
+    Streaming version of generate_cards: yields each card as soon as it is ready.
+    
+    Single-chunk texts stream straight from Gemini. For chunked documents,
+    cards from each chunk are yielded as that chunk finishes.
+    """
+    chunks = split_text_by_tokens(text)
+    if len(chunks) <= 1:
+        async for card in _stream_deck(
+            _text_card_prompt(text, num_cards),
+            TEXT_CARD_CONFIG,
+            num_cards,
+            lambda missing, existing: _cards_from_text(text, missing, existing, api_clients),
+            api_clients,
+        ):
+            yield card
+        return
+
+    deck = _DeckBuilder(num_cards)
+    per_chunk = _candidates_per_chunk(num_cards, len(chunks))
+    # Each chunk's first cards are yielded right away; the rest wait until
+    # every chunk had a chance, so the deck still covers the whole document
+    share = math.ceil(num_cards / len(chunks))
+    leftovers = []
+    tasks = [asyncio.create_task(_cards_from_chunk(chunk, per_chunk, api_clients)) for chunk in chunks]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            cards = await next_done
+            leftovers.extend(cards[share:])
+            for card in cards[:share]:
+                if deck.add(card):
+                    yield card
+        for card in leftovers:
+            if deck.add(card):
+                yield card
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    next_chunk = itertools.cycle(chunks)
+    async for card in _stream_top_up(
+        deck,
+        lambda missing, existing: _cards_from_text(next(next_chunk), missing, existing, api_clients),
+    ):
+        yield card
+
+
+async def stream_topic_selection(subject, num_cards=DECK_SIZE, api_clients=None):
+    """
+    Streaming version of topic_selection: yields each card as soon as it is ready.
+    """
+    async for card in _stream_deck(
+        _subject_card_prompt(subject, num_cards),
+        SUBJECT_CARD_CONFIG,
+        num_cards,
+        lambda missing, existing: _cards_from_subject(subject, missing, existing, api_clients),
+        api_clients,
+    ):
+        yield card
+
+
+async def stream_edit_flashcards(flashcards, user_input, api_clients=None):
+    """
+    Streaming version of edit_flashcards: yields the cards of the edited deck
+    as they are generated. If nothing usable comes back, the original cards
+    are yielded instead.
+    """
+    produced = 0
+    try:
+        async with contextlib.aclosing(_stream_cards(_edit_prompt(flashcards, user_input), EDIT_CARD_CONFIG, api_clients)) as cards:
+            async for card in cards:
+                produced += 1
+                yield card
+    except Exception as e:
+        print(f"Error streaming modified flashcards: {e}")
+        if produced:
+            raise
+
+    if not produced:
+        for card in flashcards:
+            yield card
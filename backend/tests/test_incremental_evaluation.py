@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+import pytest
+
+from app.routers.utils import incremental_evaluation
+from app.stores import MemoryStore
+
+WELCOME = {"role": "assistant", "content": "Hi! I'm your student today. What would you like to teach me?"}
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+@pytest.fixture
+def scored(monkeypatch):
+    """Record how many messages each evaluation call sends to the model."""
+    calls = []
+
+    async def fake_generate(name, messages, config, extra_parts=()):
+        calls.append(len(messages))
+        scores = {key: 5 for key in incremental_evaluation.EVALUATION_KEYS}
+        return FakeResponse(json.dumps(scores))
+
+    monkeypatch.setattr(incremental_evaluation, "generate_with_prompt", fake_generate)
+    monkeypatch.setattr(incremental_evaluation, "INCREMENTAL_EVALUATION", True)
+    monkeypatch.setattr(incremental_evaluation, "EVALUATION_DELTA_MIN_MESSAGES", 4)
+    monkeypatch.setattr(incremental_evaluation, "EVALUATION_DELTA_CONTEXT_MESSAGES", 4)
+    monkeypatch.setattr(incremental_evaluation, "EVALUATION_CHECKPOINT_LOOKBACK", 8)
+    monkeypatch.setattr(incremental_evaluation, "checkpoint_store", MemoryStore())
+    return calls
+
+
+def conversation(topic, turns):
+    messages = [WELCOME]
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"{topic} lesson, part {turn}"})
+        messages.append({"role": "assistant", "content": f"I see, tell me more about {topic} {turn}"})
+    return messages
+
+
+async def run_conversation(messages):
+    """Schedule background scoring after every turn, then evaluate the whole conversation."""
+    for end in range(3, len(messages) + 1, 2):
+        incremental_evaluation.schedule(messages[:end])
+        await asyncio.gather(*incremental_evaluation._background_evaluations)
+    return await incremental_evaluation.evaluate_incremental(messages)
+
+
+def test_conversations_sharing_an_opening_message_keep_their_own_checkpoints(scored):
+    asyncio.run(run_conversation(conversation("photosynthesis", 10)))
+    scored.clear()
+
+    asyncio.run(run_conversation(conversation("fractions", 5)))
+
+    # The first 5 messages, then 4 new ones with 4 of context, then the
+    # last 2 with 4 of context: never the whole history again
+    assert scored == [5, 8, 6]
+
+
+def test_final_evaluation_reuses_the_background_checkpoint(scored):
+    messages = conversation("fractions", 4)
+    asyncio.run(run_conversation(messages))
+    calls = len(scored)
+
+    asyncio.run(incremental_evaluation.evaluate_incremental(messages))
+
+    assert len(scored) == calls